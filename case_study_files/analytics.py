@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import pprint
+import re
+
+import numpy as np
+import pandas as pd
+
+import cuisine as cuisine_auditor
+import data as data_processor
+"""
+Offline versions of the notebook's MongoDB queries.
+
+The "Overview of the data" and "Other interesting facts" sections of the
+notebook each run a separate query against MongoDB. summary() computes all
+of them from one pandas frame of the shaped documents, with no database
+running, and returns the same values the queries return:
+
+    summary(data_processor.iter_map(OSMFILE))
+    summary_from_collection(collection)      # the same, from MongoDB
+
+Both follow MongoDB's rules rather than pandas' where they differ: a tag
+nested under another one (e.g. {"amenity": {"disused": ...}}) is its own
+group or distinct value, $push/$first skip documents without the field,
+a missing naptan.Street groups under None, and the bicycle capacity total
+uses JavaScript's Number() and truthiness, so non-numeric capacities make it
+NaN just like the notebook's map-reduce. Groups with equal counts are ordered
+by their key, where MongoDB leaves the order unspecified.
+"""
+
+TOP_N = 10
+TOP_STREETS = 5
+
+FRAME_COLUMNS = ["type", "user", "amenity", "cuisine", "name", "capacity", "highway",
+                 "has_naptan", "naptan_street"]
+
+
+class EmbeddedDocument(object):
+    """Hashable stand-in for a dictionary value, so that it can be grouped
+    and counted like MongoDB groups embedded documents."""
+    __slots__ = ("value", "key")
+
+    def __init__(self, value):
+        self.value = value
+        self.key = json.dumps(value)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, EmbeddedDocument) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _hashable(value):
+    if isinstance(value, dict):
+        return EmbeddedDocument(value)
+    return value
+
+
+def _plain(value):
+    if isinstance(value, EmbeddedDocument):
+        return value.value
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def to_frame(documents):
+    """One row per shaped document, with the fields the queries use. Missing
+    fields are None; dictionary values are wrapped in EmbeddedDocument."""
+    rows = []
+    for el in documents:
+        naptan = el.get("naptan")
+        rows.append((
+            el.get("type"),
+            _hashable(el.get("created", {}).get("user")),
+            _hashable(el.get("amenity")),
+            _hashable(el.get("cuisine")),
+            _hashable(el.get("name")),
+            _hashable(el.get("capacity")),
+            _hashable(el.get("highway")),
+            "naptan" in el,
+            _hashable(naptan.get("Street")) if isinstance(naptan, dict) else None,
+        ))
+    return pd.DataFrame.from_records(rows, columns=FRAME_COLUMNS)
+
+
+def _sort_key(value):
+    if isinstance(value, EmbeddedDocument):
+        return (1, value.key)
+    return (0, value)
+
+
+def _top(counts, n):
+    """(value, count) pairs of a value_counts() Series, most common first."""
+    items = sorted(counts.iteritems(), key=lambda item: (-item[1], _sort_key(item[0])))
+    return items if n is None else items[:n]
+
+
+js_number = re.compile(r'^[+-]?(?:Infinity|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)$')
+js_hex_number = re.compile(r'^0[xX][0-9a-fA-F]+$')
+js_whitespace = u' \t\n\r\x0b\x0c\xa0﻿  '
+
+
+def to_js_number(value):
+    """JavaScript's Number(value) for the values found in shaped documents."""
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, basestring):
+        text = value.strip(js_whitespace) if isinstance(value, unicode) else value.strip()
+        if text == "":
+            return 0.0
+        if js_hex_number.match(text):
+            return float(int(text, 16))
+        if js_number.match(text):
+            return float(text.replace("Infinity", "inf"))
+    return float("nan")
+
+
+def is_js_truthy(value):
+    if value is None:
+        return False
+    if isinstance(value, basestring):
+        return value != ""
+    if isinstance(value, (int, long, float)):
+        return value != 0 and value == value
+    return True
+
+
+def summary(documents, frame=None):
+    """Compute every notebook query from 'documents' (or a ready 'frame')."""
+    df = frame if frame is not None else to_frame(documents)
+    results = {}
+
+    results["records"] = len(df)
+    results["nodes"] = int((df["type"] == "node").sum())
+    results["ways"] = int((df["type"] == "way").sum())
+    # distinct() counts null as a value of its own but skips missing fields.
+    results["unique_users"] = int(df["user"].nunique(dropna=False))
+    results["unique_amenities"] = int(df["amenity"].dropna().nunique())
+    results["unique_cuisines"] = int(df["cuisine"].dropna().nunique())
+    results["colleges"] = int(df["amenity"].isin(["university", "college"]).sum())
+
+    results["top_amenities"] = [{"_id": _plain(value), "count": int(count)}
+                                for value, count in _top(df["amenity"].dropna().value_counts(), TOP_N)]
+    results["top_cuisines"] = [{"_id": _plain(value), "count": int(count)}
+                               for value, count in _top(df["cuisine"].dropna().value_counts(), TOP_N)]
+
+    eating = df[df["amenity"].isin(cuisine_auditor.food_amenities) & df["name"].notnull()]
+    places = []
+    if len(eating):
+        # $first of the amenity, and the first cuisine $push collected.
+        amenities = eating.drop_duplicates("name").set_index("name")["amenity"]
+        cuisines = eating.dropna(subset=["cuisine"]).drop_duplicates("name").set_index("name")["cuisine"]
+        for name, count in _top(eating["name"].value_counts(), TOP_N):
+            amenity, cuisine = amenities[name], cuisines.get(name)
+            places.append({"count": int(count), "name": _plain(name),
+                           "type": u"{0} - {1}".format(amenity, cuisine if cuisine is not None else "unknown cuisine")})
+    results["top_eating_places"] = places
+
+    capacities = [to_js_number(_plain(value))
+                  for value in df.loc[df["amenity"] == "bicycle_parking", "capacity"]
+                  if is_js_truthy(_plain(value))]
+    results["bicycle_parking_capacity"] = (
+        [{"_id": "total_bicycle_parking_capacity", "value": float(np.sum(capacities))}]
+        if capacities else [])
+
+    bus_stops = df.loc[df["has_naptan"] & (df["highway"] == "bus_stop"), "naptan_street"]
+    results["bus_stops_per_street"] = [{"num_bus_stops": int(count), "street_name": _plain(value)}
+                                       for value, count in _top(bus_stops.value_counts(dropna=False), TOP_STREETS)]
+    return results
+
+
+def summary_from_collection(collection):
+    """Run the notebook's queries against 'collection', with results in the
+    same shape as summary()."""
+    results = {}
+    results["records"] = collection.count_documents({})
+    results["nodes"] = collection.count_documents({"type": "node"})
+    results["ways"] = collection.count_documents({"type": "way"})
+    results["unique_users"] = len(collection.distinct("created.user"))
+    results["unique_amenities"] = len(collection.distinct("amenity"))
+    results["unique_cuisines"] = len(collection.distinct("cuisine"))
+    results["colleges"] = collection.count_documents({"amenity": {"$in": ["university", "college"]}})
+
+    results["top_amenities"] = list(collection.aggregate([
+        {"$match": {"amenity": {"$exists": 1}}},
+        {"$group": {"_id": "$amenity", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": TOP_N}
+    ]))
+    results["top_cuisines"] = list(collection.aggregate([
+        {"$match": {"cuisine": {"$exists": 1}}},
+        {"$group": {"_id": "$cuisine", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": TOP_N}
+    ]))
+    results["top_eating_places"] = list(collection.aggregate([
+        {"$match": {"amenity": {"$in": cuisine_auditor.food_amenities}}},
+        {"$match": {"name": {"$exists": 1}}},
+        {"$group": {
+            "_id": "$name",
+            "amenity": {"$first": "$amenity"},
+            "cuisine": {"$push": "$cuisine"},
+            "count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0,
+            "count": 1,
+            "name": "$_id",
+            "type": {"$concat": [
+                "$amenity", " - ",
+                {"$ifNull": [{"$arrayElemAt": ["$cuisine", 0]}, "unknown cuisine"]}
+            ]}
+        }},
+        {"$sort": {"count": -1}},
+        {"$limit": TOP_N}
+    ]))
+
+    from bson.code import Code
+    results["bicycle_parking_capacity"] = collection.inline_map_reduce(
+        Code("function() {"
+             "    if (this.capacity) {"
+             "        emit('total_bicycle_parking_capacity', Number(this.capacity));"
+             "    }"
+             "}"),
+        Code("function(key, values) {"
+             "    var total = 0;"
+             "    for (var i = 0; i < values.length; i++) {"
+             "        total += values[i];"
+             "    }"
+             "    return total;"
+             "}"),
+        query={"amenity": "bicycle_parking"})
+
+    results["bus_stops_per_street"] = list(collection.aggregate([
+        {"$match": {"naptan": {"$exists": 1}, "highway": "bus_stop"}},
+        {"$group": {"_id": "$naptan.Street", "num_bus_stops": {"$sum": 1}}},
+        {"$project": {"_id": 0, "num_bus_stops": 1, "street_name": "$_id"}},
+        {"$sort": {"num_bus_stops": -1}},
+        {"$limit": TOP_STREETS}
+    ]))
+    return results
+
+
+# The decimal strings $convert turns into a double.
+decimal_number = re.compile(r'^[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$')
+
+
+def to_double(value):
+    """$convert to "double" with onError/onNull null: numbers and decimal
+    strings convert, everything else (including missing) gives None."""
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, (int, long, float)):
+        return float(value)
+    if isinstance(value, basestring) and decimal_number.match(value):
+        return float(value)
+    return None
+
+
+def numeric_summary_pipeline(field, group_by="amenity", match=None):
+    """Aggregation pipeline giving the sum, min, max and count of the numeric
+    values of 'field' per value of 'group_by'.
+
+    Values are converted on the server with $convert; the ones that do not
+    convert (such as capacity="lots") are counted as 'skipped' instead of
+    turning the total into NaN.
+    """
+    if match is None:
+        match = {field: {"$exists": 1}}
+    # null and NaN both sort before -Infinity, so this keeps the numbers only.
+    is_number = {"$gte": ["$value", float("-inf")]}
+    return [
+        {"$match": match},
+        {"$project": {
+            "_id": 0,
+            "group": "$" + group_by,
+            "value": {"$convert": {"input": "$" + field, "to": "double", "onError": None, "onNull": None}}
+        }},
+        {"$group": {
+            "_id": "$group",
+            "sum": {"$sum": {"$cond": [is_number, "$value", 0]}},
+            "min": {"$min": {"$cond": [is_number, "$value", None]}},
+            "max": {"$max": {"$cond": [is_number, "$value", None]}},
+            "count": {"$sum": {"$cond": [is_number, 1, 0]}},
+            "skipped": {"$sum": {"$cond": [is_number, 0, 1]}}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
+
+
+def numeric_summary_from_collection(collection, field, group_by="amenity", match=None):
+    return list(collection.aggregate(numeric_summary_pipeline(field, group_by, match)))
+
+
+def numeric_summary(documents, field, group_by="amenity", match=None):
+    """Offline numeric_summary_pipeline over the shaped 'documents'. 'match'
+    is a function of the document, by default whether it has 'field'."""
+    if match is None:
+        match = lambda el: field in el
+    rows = []
+    groups = {}
+    for el in documents:
+        if match(el):
+            group = _hashable(el.get(group_by))
+            # pandas drops null group keys, so group on the (never null)
+            # sort key and map it back to the value afterwards.
+            key = _sort_key(group)
+            groups[key] = group
+            rows.append((key, to_double(el.get(field))))
+    if not rows:
+        return []
+    df = pd.DataFrame.from_records(rows, columns=["key", "value"])
+    stats = df.groupby("key", sort=True)["value"].agg(["sum", "min", "max", "count", "size"])
+    return [{"_id": _plain(groups[key]),
+             "sum": float(row["sum"]),
+             "min": None if row["count"] == 0 else float(row["min"]),
+             "max": None if row["count"] == 0 else float(row["max"]),
+             "count": int(row["count"]),
+             "skipped": int(row["size"] - row["count"])}
+            for key, row in stats.iterrows()]
+
+
+def test():
+    documents = [
+        {"type": "node", "created": {"user": "a"}, "amenity": "pub", "name": "The Eagle"},
+        {"type": "node", "created": {"user": "a"}, "amenity": "pub", "name": "The Eagle", "cuisine": "british"},
+        {"type": "node", "created": {"user": "b"}, "amenity": "pub", "name": "The Turf"},
+        {"type": "node", "created": {"user": "b"}, "amenity": "cafe", "cuisine": "coffee_shop"},
+        {"type": "node", "created": {"user": None}, "amenity": {"disused": "bar"}},
+        {"type": "node", "created": {"user": "c"}, "amenity": "university"},
+        {"type": "node", "created": {"user": "c"}, "amenity": "bicycle_parking", "capacity": "10"},
+        {"type": "node", "created": {"user": "c"}, "amenity": "bicycle_parking", "capacity": " 0x4 "},
+        {"type": "node", "created": {"user": "c"}, "amenity": "bicycle_parking", "capacity": ""},
+        {"type": "node", "created": {"user": "c"}, "highway": "bus_stop", "naptan": {"Street": "High Street"}},
+        {"type": "node", "created": {"user": "c"}, "highway": "bus_stop", "naptan": {"Street": "High Street"}},
+        {"type": "node", "created": {"user": "c"}, "highway": "bus_stop", "naptan": {"AtcoCode": "1"}},
+        {"type": "way", "created": {"user": "d"}, "highway": "residential"},
+    ]
+    results = summary(documents)
+    pprint.pprint(results)
+    assert results["records"] == 13 and results["nodes"] == 12 and results["ways"] == 1
+    assert results["unique_users"] == 5
+    assert results["unique_amenities"] == 5
+    assert results["colleges"] == 1
+    assert results["top_amenities"][0] == {"_id": "bicycle_parking", "count": 3}
+    assert {"_id": {"disused": "bar"}, "count": 1} in results["top_amenities"]
+    assert results["top_eating_places"] == [{"count": 2, "name": "The Eagle", "type": "pub - british"},
+                                            {"count": 1, "name": "The Turf", "type": "pub - unknown cuisine"}]
+    assert results["bicycle_parking_capacity"] == [{"_id": "total_bicycle_parking_capacity", "value": 14.0}]
+    assert results["bus_stops_per_street"] == [{"num_bus_stops": 2, "street_name": "High Street"},
+                                               {"num_bus_stops": 1, "street_name": None}]
+
+    documents.append({"type": "node", "amenity": "bicycle_parking", "capacity": "lots"})
+    assert np.isnan(summary(documents)["bicycle_parking_capacity"][0]["value"])
+    stats = numeric_summary(documents, "capacity")
+    pprint.pprint(stats)
+    assert stats == [{"_id": "bicycle_parking", "sum": 10.0, "min": 10.0, "max": 10.0, "count": 1, "skipped": 3}]
+    stats = numeric_summary(documents + [{"capacity": "2.5"}, {"amenity": "bench", "capacity": {"seats": "3"}}],
+                            "capacity")
+    assert [(doc["_id"], doc["sum"], doc["min"], doc["skipped"]) for doc in stats] == \
+        [(None, 2.5, 2.5, 0), ("bench", 0.0, None, 1), ("bicycle_parking", 10.0, 10.0, 3)]
+
+    # The pipelines mongomock can run give the same answers.
+    import mongomock
+    collection = mongomock.MongoClient().osm.example
+    documents = data_processor.process_map('example.osm') + documents
+    collection.insert_many([dict(el) for el in documents])
+    offline = summary(documents)
+    expected = {
+        "records": collection.count_documents({}),
+        "nodes": collection.count_documents({"type": "node"}),
+        "ways": collection.count_documents({"type": "way"}),
+        "unique_users": len(collection.distinct("created.user")),
+        "unique_amenities": len(collection.distinct("amenity")),
+        "unique_cuisines": len(collection.distinct("cuisine")),
+        "colleges": collection.count_documents({"amenity": {"$in": ["university", "college"]}}),
+    }
+    for key, value in expected.iteritems():
+        assert offline[key] == value, key
+    amenities = list(collection.aggregate([
+        {"$match": {"amenity": {"$exists": 1}}},
+        {"$group": {"_id": "$amenity", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}}
+    ]))
+    assert sorted(amenities, key=lambda doc: (-doc["count"], json.dumps(doc["_id"])))[:TOP_N] == \
+        [dict(doc) for doc in offline["top_amenities"]]
+
+if __name__ == "__main__":
+    test()
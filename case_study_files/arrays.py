@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from array import array
+from bisect import bisect_left
+"""
+Helpers for the compact, array backed structures used on large OSM files.
+
+OSM ids no longer fit in 32 bits, but Python 2's array module has no 'q'
+typecode and 'l' is only 64 bits wide on some platforms, so INT64 picks
+whichever is available and 8 bytes wide. geometry.py reads these buffers
+as numpy int64, so on platforms with neither (a 32 bit C long, as on
+Windows) importing this module fails rather than garbling the ids. INT32
+is the typecode of a 4 byte int.
+"""
+
+
+def _itemsize(typecode):
+    try:
+        return array(typecode).itemsize
+    except ValueError:
+        return None
+
+
+INT64 = next((typecode for typecode in ('q', 'l') if _itemsize(typecode) == 8), None)
+if INT64 is None:
+    raise ImportError("The array module has no 8 byte integer typecode on this platform")
+
+INT32 = 'i' if array('i').itemsize == 4 else 'l'
+
+
+def int64_array(values=()):
+    return array(INT64, values)
+
+
+def int32_array(values=()):
+    return array(INT32, values)
+
+
+def contains(sorted_values, value):
+    """Binary search membership test on a sorted sequence."""
+    i = bisect_left(sorted_values, value)
+    return i < len(sorted_values) and sorted_values[i] == value
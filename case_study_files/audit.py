@@ -9,10 +9,13 @@ Your task in this exercise has two steps:
     The function takes a string with street name as an argument and should return the fixed name
     We have provided a simple test so that you see what exactly is expected
 """
-import xml.etree.cElementTree as ET
 from collections import defaultdict
 import re
 import pprint
+from bisect import bisect_left
+
+import lru
+import walker
 
 OSMFILE = "example.osm"
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
@@ -42,16 +45,31 @@ def is_street_name(elem):
     return (elem.attrib['k'] == "addr:street")
 
 
-def audit(osmfile):
-    osm_file = open(osmfile, "r")
-    street_types = defaultdict(set)
-    for event, elem in ET.iterparse(osm_file, events=("start",)):
+def street_names(element):
+    """The street names of a complete top level element, or None."""
+    if element.tag == "node" or element.tag == "way":
+        names = [tag.attrib['v'] for tag in element.iter("tag") if is_street_name(tag)]
+        if names:
+            return names
+    return None
+
+
+def audit(osmfile, processes=None):
+    """Group the unexpected street types of 'osmfile'.
 
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_street_name(tag):
-                    audit_street_type(street_types, tag.attrib['v'])
-    osm_file.close()
+    Elements are only looked at once they have been parsed in full and are
+    cleared afterwards. With 'processes' set the file is split across that
+    many worker processes by parallel.imap_elements.
+    """
+    street_types = defaultdict(set)
+    if processes:
+        import parallel
+        names = parallel.imap_elements(osmfile, street_names, processes)
+    else:
+        names = (street_names(element) for element in walker.get_element(osmfile))
+    for element_names in names:
+        for name in element_names or ():
+            audit_street_type(street_types, name)
     return street_types
 
 def update_name(name, ordered_mappings):
@@ -65,7 +83,82 @@ def update_name(name, ordered_mappings):
     return name
 
 
+STREET_CACHE_SIZE = 10000
+
+_missing = object()
+
+
+class StreetNameNormalizer(object):
+    """Precompiled version of update_name.
+
+    update_name tries every (old, new) pair of every mapping in turn and, when
+    the name ends with 'old', replaces that suffix before moving on to the
+    next pair. Here all the 'old' suffixes are stored once in a trie keyed on
+    the reversed suffix, so a single walk from the end of the name finds the
+    next pair that applies. Results are kept in an LRU cache because the same
+    street names come up over and over. The output is the same as
+    update_name(name, ordered_mappings).
+    """
+
+    def __init__(self, ordered_mappings, cache_size=STREET_CACHE_SIZE):
+        self.rules = []
+        for mapping in ordered_mappings:
+            for old, new, in mapping.iteritems():
+                self.rules.append((old, new))
+
+        # Each trie node is [children, sorted indexes of the rules ending here].
+        self.trie = [{}, []]
+        for index, (old, new) in enumerate(self.rules):
+            node = self.trie
+            for char in reversed(old):
+                node = node[0].setdefault(char, [{}, []])
+            node[1].append(index)
+        self.cache = lru.LRUCache(cache_size)
+
+    def next_rule(self, name, first):
+        """Index of the first rule from 'first' onwards whose suffix matches
+        'name', or None."""
+        best = None
+        node = self.trie
+        depth = 0
+        while True:
+            # An empty suffix only ever matches an empty name.
+            if node[1] and (depth or not name):
+                i = bisect_left(node[1], first)
+                if i < len(node[1]) and (best is None or node[1][i] < best):
+                    best = node[1][i]
+            if depth == len(name):
+                return best
+            depth += 1
+            node = node[0].get(name[-depth])
+            if node is None:
+                return best
+
+    def __call__(self, name):
+        result = self.cache.get(name, _missing)
+        if result is not _missing:
+            return result
+
+        original = name
+        first = 0
+        while True:
+            index = self.next_rule(name, first)
+            if index is None:
+                break
+            old, new = self.rules[index]
+            name = name[:-len(old)] + new if old else new
+            first = index + 1
+
+        if name == '':
+            name = None
+        return self.cache.put(original, name)
+
+
 def test():
+    normalizer = StreetNameNormalizer(ordered_mappings)
+    for name in ["West Lexington St.", "Baldwin Rd.", "Ave", "St.", ".", "", "Main Street"]:
+        assert normalizer(name) == update_name(name, ordered_mappings)
+
     st_types = audit(OSMFILE)
     assert len(st_types) == 3
     pprint.pprint(dict(st_types))
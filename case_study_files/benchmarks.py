@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import tempfile
+import time
+
+import analytics
+import data as data_processor
+import writer
+"""
+Micro-benchmarks for the loading pipeline.
+
+    $ python benchmarks.py oxford_england.osm
+    $ python benchmarks.py oxford_england.osm mongodb://localhost:27017
+
+With a MongoDB URI the bicycle capacity query is timed too, as the
+notebook's inline_map_reduce, as analytics.numeric_summary_pipeline and
+offline with analytics.numeric_summary. The documents are loaded into a
+scratch 'benchmarks.capacity' collection, which is dropped afterwards.
+"""
+
+
+def writer_throughput(documents, backends=None, compressions=(None, "gzip", "zstd")):
+    """Time writer.write_json_lines over 'documents' for every backend and
+    compression. Returns a list of (backend, compression, MB of JSON,
+    MB written to disk, MB/s of JSON)."""
+    backends = backends or writer.available_backends()
+    results = []
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for backend in backends:
+            for compression in compressions:
+                if compression == "zstd" and writer.zstandard is None:
+                    continue
+                path = os.path.join(tmp_dir, "bench.json")
+                start = time.time()
+                size = writer.write_json_lines(path, documents, backend=backend, compression=compression)
+                seconds = time.time() - start
+                on_disk = os.path.getsize(path)
+                os.remove(path)
+                results.append((backend, compression, size / 1e6, on_disk / 1e6, size / 1e6 / seconds))
+    finally:
+        os.rmdir(tmp_dir)
+    return results
+
+
+def capacity_query_times(collection, documents, repeat=3):
+    """Best time out of 'repeat' runs of each way of totalling the bicycle
+    parking capacity. Returns a list of (method, seconds)."""
+    from bson.code import Code
+    mapper = Code("function() {"
+                  "    if (this.capacity) {"
+                  "        emit('total_bicycle_parking_capacity', Number(this.capacity));"
+                  "    }"
+                  "}")
+    reducer = Code("function(key, values) {"
+                   "    var total = 0;"
+                   "    for (var i = 0; i < values.length; i++) {"
+                   "        total += values[i];"
+                   "    }"
+                   "    return total;"
+                   "}")
+    match = {"amenity": "bicycle_parking"}
+    methods = [
+        ("map-reduce", lambda: collection.inline_map_reduce(mapper, reducer, query=match)),
+        ("aggregate", lambda: analytics.numeric_summary_from_collection(collection, "capacity", match=match)),
+        ("offline", lambda: analytics.numeric_summary(
+            documents, "capacity", match=lambda el: el.get("amenity") == "bicycle_parking")),
+    ]
+    results = []
+    for method, query in methods:
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            query()
+            seconds = time.time() - start
+            best = seconds if best is None else min(best, seconds)
+        results.append((method, best))
+    return results
+
+
+def main(osm_file, mongo_uri=None):
+    documents = [el for el in data_processor.iter_map(osm_file)]
+    print "JSON writer throughput for {0} documents:".format(len(documents))
+    for backend, compression, size, on_disk, rate in writer_throughput(documents):
+        print "  {0:8} {1:5} {2:8.1f} MB -> {3:8.1f} MB on disk  {4:7.1f} MB/s".format(
+            backend, compression or "-", size, on_disk, rate)
+
+    if mongo_uri:
+        import pymongo
+        collection = pymongo.MongoClient(mongo_uri).benchmarks.capacity
+        collection.drop()
+        collection.insert_many([dict(el) for el in documents])
+        try:
+            print "Bicycle parking capacity query:"
+            for method, seconds in capacity_query_times(collection, documents):
+                print "  {0:10} {1:8.1f} ms".format(method, seconds * 1000)
+        finally:
+            collection.drop()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3] or ["example.osm"])
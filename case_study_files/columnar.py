@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import pprint
+import shutil
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import data as data_processor
+"""
+Columnar (Parquet or Arrow IPC) export of the shaped OSM data.
+
+Nodes and ways go to separate tables with typed columns: int64 ids, uids,
+versions and changesets, float64 lat/lon, dictionary-encoded strings for the
+low-cardinality tags used by the analysis (amenity, cuisine, highway, ...)
+and a list<int64> of node refs for ways. (Arrow IPC files keep those columns
+as plain strings, see TableWriter.flush.) Rows are written in record batches,
+so the export streams over data.iter_map or parallel.iter_map in bounded
+memory, and the resulting files can be grouped and counted locally with
+pyarrow or pandas instead of going through MongoDB.
+
+Tag values that are not plain strings (a tag nested under another one, such
+as {"amenity": {"disused": ...}}) are exported as nulls.
+
+    export(data_processor.iter_map(OSMFILE), "oxford_england_parquet")
+    nodes = read_table("oxford_england_parquet", "node").to_pandas()
+"""
+
+BATCH_SIZE = 65536
+
+# Dictionary-encoded string columns, taken from the top level of the shaped
+# element.
+CATEGORY_COLUMNS = ["amenity", "cuisine", "highway", "shop", "building", "tourism", "leisure"]
+DICTIONARY_COLUMNS = set(CATEGORY_COLUMNS + ["user", "naptan_street"])
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _string(value):
+    if isinstance(value, basestring):
+        return value
+    return None
+
+
+def _nested_string(el, parent, key):
+    sub = el.get(parent)
+    if isinstance(sub, dict):
+        return _string(sub.get(key))
+    return None
+
+
+def _common_columns(el):
+    created = el.get("created") or {}
+    return [
+        ("id", pa.int64(), _int(el.get("id"))),
+        ("version", pa.int64(), _int(created.get("version"))),
+        ("changeset", pa.int64(), _int(created.get("changeset"))),
+        ("timestamp", pa.string(), created.get("timestamp")),
+        ("user", pa.string(), created.get("user")),
+        ("uid", pa.int64(), _int(created.get("uid"))),
+        ("name", pa.string(), _string(el.get("name"))),
+        ("street", pa.string(), _nested_string(el, "addr", "street")),
+        ("capacity", pa.string(), _string(el.get("capacity"))),
+    ] + [(column, pa.string(), _string(el.get(column))) for column in CATEGORY_COLUMNS]
+
+
+def node_columns(el):
+    pos = el.get("pos") or (None, None)
+    return _common_columns(el) + [
+        ("lat", pa.float64(), pos[0]),
+        ("lon", pa.float64(), pos[1]),
+        ("naptan_street", pa.string(), _nested_string(el, "naptan", "Street")),
+    ]
+
+
+def way_columns(el):
+    refs = el.get("node_refs")
+    return _common_columns(el) + [
+        ("node_refs", pa.list_(pa.int64()), [int(ref) for ref in refs] if refs else None),
+    ]
+
+
+COLUMNS = {"node": node_columns, "way": way_columns}
+
+
+class TableWriter(object):
+    """Accumulates rows of one element type and writes them in batches."""
+
+    def __init__(self, path, columns, file_format="parquet", batch_size=BATCH_SIZE):
+        self.path = path
+        self.columns = columns
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.names = None
+        self.types = None
+        self.values = None
+        self.writer = None
+        self.rows = 0
+
+    def append(self, el):
+        row = self.columns(el)
+        if self.values is None:
+            self.names = [name for name, _, _ in row]
+            self.types = [column_type for _, column_type, _ in row]
+            self.values = [[] for _ in row]
+        for values, (_, _, value) in zip(self.values, row):
+            values.append(value)
+        self.rows += 1
+        if len(self.values[0]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.values or not self.values[0]:
+            return
+        arrays = []
+        for name, column_type, values in zip(self.names, self.types, self.values):
+            array = pa.array(values, type=column_type)
+            # The Arrow IPC file format needs a single dictionary for the
+            # whole file, which batches encoded one at a time do not share,
+            # so only the Parquet tables are dictionary-encoded.
+            if self.file_format == "parquet" and name in DICTIONARY_COLUMNS:
+                array = array.dictionary_encode()
+            arrays.append(array)
+        batch = pa.RecordBatch.from_arrays(arrays, self.names)
+        if self.writer is None:
+            if self.file_format == "parquet":
+                self.writer = pq.ParquetWriter(self.path, batch.schema)
+            else:
+                self.sink = pa.OSFile(self.path, "wb")
+                self.writer = pa.RecordBatchFileWriter(self.sink, batch.schema)
+        if self.file_format == "parquet":
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+        self.values = [[] for _ in self.names]
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            if self.file_format != "parquet":
+                self.sink.close()
+
+
+def table_path(out_dir, element_type, file_format="parquet"):
+    extension = "parquet" if file_format == "parquet" else "arrow"
+    return os.path.join(out_dir, "{0}s.{1}".format(element_type, extension))
+
+
+def export(documents, out_dir, file_format="parquet", batch_size=BATCH_SIZE):
+    """Write the shaped 'documents' to one table per element type in
+    'out_dir' and return the number of rows written per type.
+
+    'file_format' is "parquet" or "arrow" (the Arrow IPC file format).
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    writers = dict((element_type, TableWriter(table_path(out_dir, element_type, file_format),
+                                              columns, file_format, batch_size))
+                   for element_type, columns in COLUMNS.iteritems())
+    try:
+        for el in documents:
+            table_writer = writers.get(el.get("type"))
+            if table_writer is not None:
+                table_writer.append(el)
+    finally:
+        for table_writer in writers.itervalues():
+            table_writer.close()
+    return dict((element_type, table_writer.rows) for element_type, table_writer in writers.iteritems())
+
+
+def read_table(out_dir, element_type, file_format="parquet"):
+    path = table_path(out_dir, element_type, file_format)
+    if not os.path.exists(path):
+        return None
+    if file_format == "parquet":
+        return pq.read_table(path)
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def test():
+    documents = data_processor.process_map('example.osm')
+    out_dir = tempfile.mkdtemp()
+    try:
+        for file_format in ("parquet", "arrow"):
+            counts = export(documents, out_dir, file_format, batch_size=8)
+            pprint.pprint(counts)
+            assert counts == {"node": 20, "way": 1}
+            nodes = read_table(out_dir, "node", file_format)
+            ways = read_table(out_dir, "way", file_format)
+            assert nodes.num_rows == 20
+            assert nodes.column("id").to_pylist()[0] == 261114295
+            assert nodes.column("lat").to_pylist()[0] == 41.9730791
+            assert ways.column("node_refs").to_pylist() == [[2636086179, 2636086178, 2636086177, 2636086176]]
+            assert ways.column("highway").to_pylist() == ["service"]
+    finally:
+        shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+    test()
@@ -1,5 +1,12 @@
-import xml.etree.cElementTree as ET
+import pprint
 import data
+import parallel
+import walker
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
 
 food_amenities = ["restaurant", "cafe", "pub", "bar", "fast_food", "delicatessen"]
 
@@ -8,14 +15,127 @@ def is_food_node(tag):
     food_amenity_tag = (tag.attrib['k'] == "amenity" and tag.attrib['v'] in food_amenities)
     return cuisine_tag or food_amenity_tag
 
-def audit(osmfile):
-    osm_file = open(osmfile, "r")
+def food_node(element):
+    """The shaped element if a complete node or way is a food node, or None."""
+    if element.tag == "node" or element.tag == "way":
+        for tag in element.iter("tag"):
+            if is_food_node(tag):
+                return data.shape_element(element)
+    return None
+
+def audit(osmfile, processes=None):
+    """Shape every food node of 'osmfile'.
+
+    Elements are only looked at once they have been parsed in full and are
+    cleared afterwards. With 'processes' set the file is split across that
+    many worker processes by parallel.imap_elements.
+    """
+    if processes:
+        return list(parallel.imap_elements(osmfile, food_node, processes))
     food_nodes = []
-    for event, elem in ET.iterparse(osm_file, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_food_node(tag):
-                    food_nodes.append(data.shape_element(elem))
-                    break
-    osm_file.close()
+    for element in walker.get_element(osmfile):
+        node = food_node(element)
+        if node:
+            food_nodes.append(node)
     return food_nodes
+
+def _category_value(value):
+    if value is None or isinstance(value, basestring):
+        return value
+    return unicode(value)
+
+def to_frame(food_nodes):
+    """The food nodes as a frame with one row per node: 'id', 'name' and
+    categorical 'amenity' and 'cuisine' columns (NaN where the tag is
+    missing, which is what 'has_amenity' / 'has_cuisine' record)."""
+    if pd is None:
+        raise ImportError("to_frame needs the pandas package")
+    amenities = [_category_value(node.get('amenity')) for node in food_nodes]
+    cuisines = [_category_value(node.get('cuisine')) for node in food_nodes]
+    return pd.DataFrame({
+        'id': [node.get('id') for node in food_nodes],
+        'name': [node.get('name') for node in food_nodes],
+        'amenity': pd.Categorical(amenities),
+        'cuisine': pd.Categorical(cuisines),
+        'has_amenity': pd.Series([('amenity' in node) for node in food_nodes], dtype=bool),
+        'has_cuisine': pd.Series([('cuisine' in node) for node in food_nodes], dtype=bool),
+    }, columns=['id', 'name', 'amenity', 'cuisine', 'has_amenity', 'has_cuisine'])
+
+def audit_frame(osmfile, processes=None):
+    """audit(), as a frame (see to_frame)."""
+    return to_frame(audit(osmfile, processes))
+
+def split_cuisines(frame):
+    """One row per (node, cuisine) for the nodes with a cuisine, with
+    multi-valued cuisines such as 'indian;pizza' split into separate rows.
+    Returns a frame with the node's 'amenity' and a categorical 'cuisine'."""
+    tagged = frame[frame['has_cuisine']]
+    # pandas 0.24 has no Series.explode; split into columns and stack them
+    # back into rows instead.
+    parts = tagged['cuisine'].astype(object).str.split(';', expand=True)
+    if parts.empty:
+        cuisines = pd.Series([], dtype=object)
+    else:
+        cuisines = parts.stack().str.strip()
+        cuisines = cuisines[cuisines != ''].reset_index(level=1, drop=True)
+    return pd.DataFrame({
+        'amenity': tagged['amenity'].reindex(cuisines.index),
+        'cuisine': pd.Categorical(cuisines),
+    }, columns=['amenity', 'cuisine'])
+
+def crosstab(frame, split=True):
+    """Amenity x cuisine counts of the nodes that have both, with multi-valued
+    cuisines counted once for every cuisine when 'split' is set."""
+    both = frame[frame['has_amenity'] & frame['has_cuisine']]
+    pairs = split_cuisines(both) if split else both[['amenity', 'cuisine']]
+    counts = pairs.groupby(['amenity', 'cuisine'], observed=True).size()
+    return counts.unstack(fill_value=0)
+
+def summary(frame):
+    """The notebook's food node counts, from one group-by over the frame."""
+    groups = frame.groupby(['has_amenity', 'has_cuisine']).size()
+    count = lambda has_amenity, has_cuisine: int(groups.get((has_amenity, has_cuisine), 0))
+    without_cuisine = frame[~frame['has_cuisine']]
+    return {
+        'food_nodes': len(frame),
+        'with_cuisine_and_amenity': count(True, True),
+        'without_cuisine': count(True, False) + count(False, False),
+        'without_amenity': count(False, True) + count(False, False),
+        'amenities_without_cuisine': without_cuisine['amenity'].value_counts()[lambda counts: counts > 0],
+    }
+
+def test():
+    food_nodes = [
+        {'id': '1', 'name': 'Eagle', 'amenity': 'pub'},
+        {'id': '2', 'name': 'Taj', 'amenity': 'restaurant', 'cuisine': 'indian'},
+        {'id': '3', 'name': 'Spice', 'amenity': 'restaurant', 'cuisine': 'indian;pizza'},
+        {'id': '4', 'name': 'Pizza Hut', 'amenity': 'fast_food', 'cuisine': 'pizza'},
+        {'id': '5', 'name': 'Beans', 'amenity': 'cafe'},
+        {'id': '6', 'name': 'Deli', 'shop': 'deli', 'cuisine': 'italian'},
+    ]
+    frame = to_frame(food_nodes)
+    results = summary(frame)
+    pprint.pprint(results)
+    assert (results['food_nodes'], results['with_cuisine_and_amenity'],
+            results['without_cuisine'], results['without_amenity']) == (6, 3, 2, 1)
+    assert results['amenities_without_cuisine'].to_dict() == {'pub': 1, 'cafe': 1}
+
+    table = crosstab(frame)
+    print table
+    assert table.loc['restaurant', 'indian'] == 2
+    assert table.loc['restaurant', 'pizza'] == 1
+    assert table.loc['fast_food', 'pizza'] == 1
+    assert 'italian' not in table.columns
+    assert crosstab(frame, split=False).loc['restaurant', 'indian;pizza'] == 1
+
+    empty = to_frame([])
+    assert empty['has_cuisine'].dtype == bool
+    assert summary(empty)['food_nodes'] == 0
+    assert crosstab(empty).empty
+
+    frame = audit_frame('example.osm')
+    assert summary(frame)['food_nodes'] == len(audit('example.osm'))
+    crosstab(frame)
+
+if __name__ == "__main__":
+    test()
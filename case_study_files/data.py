@@ -1,11 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import xml.etree.cElementTree as ET
 import pprint
 import re
-import codecs
-import json
 import audit as street_name_auditor
+import interning
+import lru
+import walker
+import writer
 """
 Your task is to wrangle the data and transform the shape of the data
 into the model we mentioned earlier. The output should be a list of dictionaries
@@ -85,6 +86,15 @@ In particular the following things should be done:
 
 should be turned into
 "node_refs": ["305896090", "1719825889"]
+
+- "relation" elements are shaped too, with their members in a typed list:
+
+  <member type="way" ref="110160127" role="from"/>
+
+should be turned into
+"members": [{"type": "way", "ref": "110160127", "role": "from"}]
+  and the relation's own "type" tag (multipolygon, route, ...) stored as
+  "relation_type", so that "type" stays "relation".
 """
 
 
@@ -118,32 +128,52 @@ CREATED = [ "version", "changeset", "timestamp", "user", "uid"]
 # "phone": "1 (773)-271-5176"
 # }
 
+# Interning tables for the strings that repeat across elements; see
+# interning.py. Ids, positions, node refs, timestamps and changesets are
+# (nearly) unique and are left alone: they would only fill up the bounded
+# table before the user names seen later in the file got in.
+attribute_strings = interning.InternTable()
+tag_values = interning.InternTable()
+
 def shape_element(element):
     node = {}
-    if element.tag == "node" or element.tag == "way" :
+    if element.tag == "node" or element.tag == "way" or element.tag == "relation":
         node["id"] = element.get("id")
         node["type"] = element.tag
-        node["visible"] = element.get("visible")
+        node["visible"] = attribute_strings(element.get("visible"))
         node["created"] = {
-                "version" : element.get("version"),
+                "version" : attribute_strings(element.get("version")),
                 "changeset" : element.get("changeset"),
                 "timestamp" : element.get("timestamp"),
-                "user" : element.get("user"),
-                "uid" : element.get("uid")
+                "user" : attribute_strings(element.get("user")),
+                "uid" : attribute_strings(element.get("uid"))
             }
         if element.get("lat") and element.get("lon"):
             node["pos"] = [float(element.get("lat")), float(element.get("lon"))]
         for child in list(element):
             key_string = child.get("k")
             if key_string:
-                keys = process_key_string(key_string)
-                node = handle_nested_keys(node, keys, child.get("v"))
+                if key_string == "type" and element.tag == "relation":
+                    node["relation_type"] = tag_values(child.get("v"))
+                else:
+                    apply_tag(node, key_string, tag_values(child.get("v")))
             elif element.tag == "way":
                 if child.tag == "nd":
                     if "node_refs" in node:
                         node["node_refs"].append(child.get("ref"))
                     else:
                         node["node_refs"] = [child.get("ref")]
+            elif element.tag == "relation":
+                if child.tag == "member":
+                    member = {
+                        "type": attribute_strings(child.get("type")),
+                        "ref": child.get("ref"),
+                        "role": attribute_strings(child.get("role"))
+                    }
+                    if "members" in node:
+                        node["members"].append(member)
+                    else:
+                        node["members"] = [member]
 
         return node
     else:
@@ -185,27 +215,80 @@ sreet_name_mapping = [
     'Ave': 'Avenue'}
 ]
 
+street_name_normalizer = street_name_auditor.StreetNameNormalizer(sreet_name_mapping)
+
 def process_key_and_value(key, value):
     if key == 'addr':
         key = 'address'
     elif key == 'street':
-        value = street_name_auditor.update_name(value, sreet_name_mapping)
+        value = street_name_normalizer(value)
     return key, value
 
-def process_map(file_in, pretty = False):
-    # You do not need to change this file
+KEY_CACHE_SIZE = 100000
+_key_plan_cache = lru.LRUCache(KEY_CACHE_SIZE)
+
+def compile_key(key_string):
+    """Compile a raw tag key into the plan apply_tag follows.
+
+    The plan is (parents, key, is_street): the dictionaries to descend into,
+    the key the value is finally stored under (after the 'addr' -> 'address'
+    rewrite) and whether the value is a street name to normalise. This is
+    what process_key_string, handle_nested_keys and process_key_and_value work
+    out for every single tag; plans are cached per raw key.
+    """
+    plan = _key_plan_cache.get(key_string)
+    if plan is None:
+        keys = process_key_string(key_string)
+        parents, key = tuple(keys[:-1]), keys[-1]
+        is_street = False
+        if key == 'addr':
+            key = 'address'
+        elif key == 'street':
+            is_street = True
+        plan = _key_plan_cache.put(key_string, (parents, key, is_street))
+    return plan
+
+def apply_tag(node, key_string, value):
+    """Flat, non-recursive equivalent of
+    handle_nested_keys(node, process_key_string(key_string), value)."""
+    parents, key, is_street = compile_key(key_string)
+    for parent in parents:
+        if parent in node:
+            sub_node = node[parent]
+            # Like handle_nested_keys, never write into a non-dict value.
+            if not isinstance(sub_node, dict):
+                return
+        else:
+            sub_node = node[parent] = {}
+        node = sub_node
+    if is_street:
+        value = street_name_normalizer(value)
+    if value != None:
+        node[key] = value
+
+def iter_map(file_in, pretty = False, backend = "json", compression = None):
+    """Stream the shaped elements of 'file_in', one dictionary at a time.
+
+    Every shaped element is written to '<file_in>.json' (plus '.gz' or '.zst'
+    with 'compression') through a buffered writer.JSONLinesWriter and its
+    subtree is cleared straight away, so memory use does not grow with the
+    size of the input. See writer.py for the available JSON backends.
+    """
     file_out = "{0}.json".format(file_in)
-    data = []
-    with codecs.open(file_out, "w") as fo:
-        for _, element in ET.iterparse(file_in):
+    if compression == "gzip":
+        file_out += ".gz"
+    elif compression == "zstd":
+        file_out += ".zst"
+    with writer.JSONLinesWriter(file_out, backend, compression, pretty) as fo:
+        for element in walker.get_element(file_in):
             el = shape_element(element)
             if el:
-                data.append(el)
-                if pretty:
-                    fo.write(json.dumps(el, indent=2)+"\n")
-                else:
-                    fo.write(json.dumps(el) + "\n")
-    return data
+                fo.write(el)
+                yield el
+
+def process_map(file_in, pretty = False, backend = "json", compression = None):
+    # You do not need to change this file
+    return list(iter_map(file_in, pretty, backend, compression))
 
 def test():
     # NOTE: if you are running this code on your computer, with a larger dataset,
@@ -228,6 +311,10 @@ def test():
         }
     }
     assert data[0] == correct_first_elem
+    assert data[-1]["type"] == "relation"
+    assert data[-1]["relation_type"] == "restriction"
+    assert data[-1]["members"][1] == {"type": "way", "ref": "110160127", "role": "from"}
+    data.pop()
     assert data[-1]["address"] == {
                                     "street": "West Lexington St.",
                                     "housenumber": "1412"
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import pprint
+import shutil
+import tempfile
+
+import numpy as np
+
+import arrays
+import data as data_processor
+import walker
+"""
+GeoJSON geometries for the shaped elements.
+
+The shaped documents keep the position of a node as 'pos': [lat, lon] and a
+way as a list of 'node_refs'. MongoDB's 2dsphere indexes need GeoJSON
+instead, so the loader adds a 'geometry' field: a Point for nodes and a
+LineString or Polygon for ways, assembled from the coordinates of their
+nodes while the file is read (nodes come before ways in an OSM file):
+
+    loader.load(collection, with_geometry(data_processor.iter_map(OSMFILE)),
+                indexes=indexes.INDEXES)
+
+The node coordinates are kept in a NodeCoordinateIndex: sorted int64 ids
+next to int32 latitudes and longitudes in units of 1e-7 degrees (the
+precision of the OSM database), 16 bytes per node, searched with a binary
+search. For extracts too large to keep in memory the index can be built
+once with NodeCoordinateIndex.from_file, saved, and memory-mapped:
+
+    NodeCoordinateIndex.from_file(OSMFILE).save("oxford_england.nodes.npy")
+    index = NodeCoordinateIndex.load("oxford_england.nodes.npy")
+    documents = with_geometry(data_processor.iter_map(OSMFILE), index)
+
+Positions outside of the valid longitude/latitude range get no geometry,
+and neither do ways with nodes missing from the extract, since a single
+invalid geometry would make the 2dsphere index build fail. For the same
+reason a closed area way only becomes a Polygon if its outline is a simple
+ring (is_simple_ring); a self-intersecting one is kept as a LineString.
+"""
+
+SCALE = 10 ** 7
+
+NODE_DTYPE = np.dtype([("id", "<i8"), ("lat", "<i4"), ("lon", "<i4")])
+
+# Closed ways with one of these tags are areas, unless tagged area=no.
+AREA_KEYS = frozenset(["building", "landuse", "amenity", "leisure", "natural", "shop", "tourism",
+                       "place", "historic", "man_made", "university", "parking"])
+
+
+def point_geometry(pos):
+    """GeoJSON Point for a [lat, lon] position, or None."""
+    if not pos or len(pos) != 2:
+        return None
+    lat, lon = pos
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+class NodeCoordinateIndex(object):
+    """Map of node id to (lat, lon), 16 bytes per node.
+
+    Nodes are appended with add() and the index is sorted by id (if they did
+    not arrive in order already) on the first lookup.
+    """
+
+    def __init__(self, records=None):
+        self.records = records if records is not None else np.empty(0, dtype=NODE_DTYPE)
+        # A complete index (loaded or built from a file) is not added to by
+        # with_geometry.
+        self.complete = records is not None
+        self.ids = arrays.int64_array()
+        self.lats = arrays.int32_array()
+        self.lons = arrays.int32_array()
+        self.in_order = True
+        self.last_id = None
+
+    def __len__(self):
+        return len(self.records) + len(self.ids)
+
+    def add(self, node_id, lat, lon):
+        if self.last_id is not None and node_id <= self.last_id:
+            self.in_order = False
+        self.last_id = node_id
+        self.ids.append(node_id)
+        self.lats.append(int(round(lat * SCALE)))
+        self.lons.append(int(round(lon * SCALE)))
+
+    def add_element(self, el):
+        """Add a shaped node document."""
+        pos = el.get("pos")
+        if el.get("type") == "node" and point_geometry(pos) is not None:
+            self.add(int(el["id"]), pos[0], pos[1])
+
+    def finish(self):
+        """Merge the nodes added since the last lookup into the sorted records."""
+        if not self.ids:
+            return self
+        added = np.empty(len(self.ids), dtype=NODE_DTYPE)
+        added["id"] = np.frombuffer(self.ids, dtype=np.int64)
+        added["lat"] = np.frombuffer(self.lats, dtype=np.int32)
+        added["lon"] = np.frombuffer(self.lons, dtype=np.int32)
+        in_order = self.in_order and (not len(self.records) or self.records["id"][-1] < added["id"][0])
+        records = np.concatenate((self.records, added)) if len(self.records) else added
+        if not in_order:
+            records = records[np.argsort(records["id"], kind="mergesort")]
+        self.records = records
+        self.ids = arrays.int64_array()
+        self.lats = arrays.int32_array()
+        self.lons = arrays.int32_array()
+        self.in_order = True
+        return self
+
+    def lookup(self, node_ids):
+        """Coordinates of 'node_ids' as two float arrays (lat, lon) and a
+        boolean array of which ids were found."""
+        self.finish()
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if not len(self.records):
+            missing = np.zeros(len(node_ids))
+            return missing, missing, missing.astype(bool)
+        ids = self.records["id"]
+        positions = np.searchsorted(ids, node_ids)
+        positions[positions == len(ids)] = 0
+        found = self.records[positions]
+        return found["lat"] / float(SCALE), found["lon"] / float(SCALE), found["id"] == node_ids
+
+    def get(self, node_id):
+        """(lat, lon) of a node, or None."""
+        lats, lons, found = self.lookup([node_id])
+        if not found[0]:
+            return None
+        return float(lats[0]), float(lons[0])
+
+    def save(self, path):
+        np.save(path, self.finish().records)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        return cls(np.load(path, mmap_mode="r" if mmap else None))
+
+    @classmethod
+    def from_file(cls, osm_file):
+        """Index the nodes of an OSM file, without shaping them."""
+        index = cls()
+        for element in walker.get_element(osm_file, tags=("node",)):
+            lat, lon = element.get("lat"), element.get("lon")
+            if lat and lon and point_geometry([float(lat), float(lon)]) is not None:
+                index.add(int(element.get("id")), float(lat), float(lon))
+        index.finish().complete = True
+        return index
+
+
+class WayIndex(object):
+    """Map of way id to its node ids, kept as sorted int64 way ids with
+    offsets into one int64 array of node ids."""
+
+    def __init__(self):
+        self.way_ids = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.node_ids = np.empty(0, dtype=np.int64)
+        self.added_ways = arrays.int64_array()
+        self.added_lengths = arrays.int64_array()
+        self.added_nodes = arrays.int64_array()
+        self.in_order = True
+        self.complete = False
+
+    def __len__(self):
+        return len(self.way_ids) + len(self.added_ways)
+
+    def add(self, way_id, node_ids):
+        if self.added_ways and way_id <= self.added_ways[-1]:
+            self.in_order = False
+        self.added_ways.append(way_id)
+        self.added_lengths.append(len(node_ids))
+        self.added_nodes.extend(node_ids)
+
+    def add_element(self, el):
+        """Add a shaped way document."""
+        try:
+            self.add(int(el["id"]), [int(ref) for ref in el.get("node_refs") or ()])
+        except ValueError:
+            pass
+
+    def finish(self):
+        if not self.added_ways:
+            return self
+        added_ways = np.frombuffer(self.added_ways, dtype=np.int64)
+        added_offsets = np.cumsum(np.frombuffer(self.added_lengths, dtype=np.int64)) + self.offsets[-1]
+        way_ids = np.concatenate((self.way_ids, added_ways))
+        offsets = np.concatenate((self.offsets, added_offsets))
+        node_ids = np.concatenate((self.node_ids, np.frombuffer(self.added_nodes, dtype=np.int64)))
+        if not self.in_order or (len(self.way_ids) and self.way_ids[-1] >= added_ways[0]):
+            order = np.argsort(way_ids, kind="mergesort")
+            starts, ends = offsets[:-1][order], offsets[1:][order]
+            node_ids = np.concatenate([node_ids[start:end] for start, end in zip(starts, ends)])
+            offsets = np.concatenate(([0], np.cumsum(ends - starts)))
+            way_ids = way_ids[order]
+        self.way_ids, self.offsets, self.node_ids = way_ids, offsets, node_ids
+        self.added_ways = arrays.int64_array()
+        self.added_lengths = arrays.int64_array()
+        self.added_nodes = arrays.int64_array()
+        self.in_order = True
+        return self
+
+    def refs(self, way_id):
+        """The node ids of a way as an int64 array, or None."""
+        self.finish()
+        i = np.searchsorted(self.way_ids, way_id)
+        if i == len(self.way_ids) or self.way_ids[i] != way_id:
+            return None
+        return self.node_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    @classmethod
+    def from_file(cls, osm_file):
+        index = cls()
+        for element in walker.get_element(osm_file, tags=("way",)):
+            index.add(int(element.get("id")), [int(nd.get("ref")) for nd in element.iter("nd")])
+        index.finish().complete = True
+        return index
+
+
+def is_area(el):
+    area = el.get("area")
+    if area == "no":
+        return False
+    return area == "yes" or any(key in el for key in AREA_KEYS)
+
+
+def node_coordinates(node_ids, index):
+    """[lon, lat] pairs of 'node_ids', or None if any of them is not in
+    'index'. Repeated vertices, which are invalid in a 2dsphere index, are
+    dropped."""
+    lats, lons, found = index.lookup(node_ids)
+    if not found.all():
+        return None
+    coordinates = []
+    for lon, lat in zip(lons.tolist(), lats.tolist()):
+        if not coordinates or coordinates[-1] != [lon, lat]:
+            coordinates.append([lon, lat])
+    return coordinates
+
+
+def _cross(o, a, b):
+    return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+
+def is_simple_ring(coordinates):
+    """True if the closed ring 'coordinates' repeats no vertex other than
+    the closing one and none of its edges cross, touch or fold back onto
+    each other; 2dsphere indexes reject Polygons with such rings."""
+    if len(set(tuple(point) for point in coordinates[:-1])) != len(coordinates) - 1:
+        return False
+    points = np.array(coordinates, dtype=np.float64)
+    starts, ends = points[:-1], points[1:]
+    # Consecutive edges share a vertex; they must not run back along each other.
+    following = np.roll(ends, -1, axis=0)
+    backtrack = (_cross(starts, ends, following) == 0) & (
+        ((ends - starts) * (following - ends)).sum(axis=1) < 0)
+    if backtrack.any():
+        return False
+    # Every other pair of edges must not meet at all. The first and the last
+    # edge share the closing vertex.
+    low, high = np.minimum(starts, ends), np.maximum(starts, ends)
+    num_edges = len(starts)
+    for i in xrange(num_edges - 2):
+        others = slice(i + 2, num_edges if i else num_edges - 1)
+        p1, p2, p3, p4 = starts[i], ends[i], starts[others], ends[others]
+        overlap = ((low[others] <= high[i]) & (high[others] >= low[i])).all(axis=1)
+        crossing = (overlap & (_cross(p3, p4, p1) * _cross(p3, p4, p2) <= 0) &
+                    (_cross(p1, p2, p3) * _cross(p1, p2, p4) <= 0))
+        if crossing.any():
+            return False
+    return True
+
+
+def way_geometry(el, index):
+    """GeoJSON LineString or Polygon for a shaped way, or None when some of
+    its nodes are not in 'index'. Closed areas whose outline is not a simple
+    ring are kept as a LineString."""
+    refs = el.get("node_refs")
+    if not refs:
+        return None
+    try:
+        coordinates = node_coordinates([int(ref) for ref in refs], index)
+    except ValueError:
+        return None
+    if coordinates is None:
+        return None
+    if (len(coordinates) >= 4 and coordinates[0] == coordinates[-1] and is_area(el)
+            and is_simple_ring(coordinates)):
+        return {"type": "Polygon", "coordinates": [coordinates]}
+    if len(coordinates) < 2:
+        return None
+    return {"type": "LineString", "coordinates": coordinates}
+
+
+def with_geometry(documents, index=None, ways=None):
+    """Add a 'geometry' to the shaped 'documents': Points for the nodes and
+    LineStrings or Polygons for the ways. The nodes go into 'index' as they
+    go past, unless it is already complete, and the ways into 'ways' when
+    given (see relations.RelationResolver)."""
+    if index is None:
+        index = NodeCoordinateIndex()
+    for el in documents:
+        if el.get("type") == "way":
+            geometry = way_geometry(el, index)
+            if ways is not None and not ways.complete:
+                ways.add_element(el)
+        else:
+            geometry = point_geometry(el.get("pos"))
+            if geometry is not None and not index.complete:
+                index.add_element(el)
+        if geometry is not None:
+            el["geometry"] = geometry
+        yield el
+
+
+def test():
+    documents = list(with_geometry(data_processor.process_map('example.osm')))
+    pprint.pprint(documents[0]["geometry"])
+    assert documents[0]["geometry"] == {"type": "Point", "coordinates": [-87.6866303, 41.9730791]}
+    # The nodes of the example way are not in the extract.
+    assert "geometry" not in documents[-1]
+    assert point_geometry([91.0, 0.0]) is None
+
+    index = NodeCoordinateIndex.from_file('example.osm')
+    assert len(index) == 20
+    assert index.get(261114295) == (41.9730791, -87.6866303)
+    assert index.get(1) is None
+
+    unordered = NodeCoordinateIndex()
+    for node_id in (5, 3, 9):
+        unordered.add(node_id, node_id / 10.0, -node_id / 10.0)
+    assert unordered.get(3) == (0.3, -0.3)
+    unordered.add(1, 0.1, -0.1)
+    assert unordered.get(1) == (0.1, -0.1) and unordered.get(9) == (0.9, -0.9)
+
+    # All four nodes lie on one line, so even as a building this is no area.
+    closed = {"type": "way", "building": "yes", "node_refs": ["1", "3", "5", "9", "1"]}
+    assert way_geometry(closed, unordered) == {
+        "type": "LineString", "coordinates": [[-0.1, 0.1], [-0.3, 0.3], [-0.5, 0.5], [-0.9, 0.9], [-0.1, 0.1]]}
+    assert way_geometry({"type": "way", "node_refs": ["1", "2"]}, unordered) is None
+
+    corners = NodeCoordinateIndex()
+    for node_id, lat, lon in [(1, 0, 0), (2, 0, 1), (3, 1, 1), (4, 1, 0), (5, 0.5, 0.5), (6, 0, 0.5)]:
+        corners.add(node_id, lat, lon)
+    square = {"type": "way", "building": "yes", "node_refs": ["1", "2", "3", "4", "1"]}
+    assert way_geometry(square, corners) == {
+        "type": "Polygon", "coordinates": [[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0], [0.0, 0.0]]]}
+    bow_tie = dict(square, node_refs=["1", "2", "4", "3", "1"])
+    assert way_geometry(bow_tie, corners)["type"] == "LineString"
+    figure_eight = dict(square, node_refs=["1", "2", "5", "3", "4", "5", "1"])
+    assert way_geometry(figure_eight, corners)["type"] == "LineString"
+    notch = dict(square, node_refs=["1", "2", "3", "4", "5", "1"])
+    assert way_geometry(notch, corners)["type"] == "Polygon"
+    spike = dict(square, node_refs=["1", "2", "6", "3", "4", "1"])
+    assert way_geometry(spike, corners)["type"] == "LineString"
+    assert is_simple_ring([[0, 0], [2, 0], [1, 1], [2, 2], [0, 2], [0, 0]])
+    assert not is_simple_ring([[0, 0], [2, 0], [0, 1], [0, 2], [0, 0]])
+
+    ways = WayIndex()
+    for way_id, refs in ((7, [1, 2]), (3, [5, 3, 9]), (5, [])):
+        ways.add(way_id, refs)
+    assert ways.refs(3).tolist() == [5, 3, 9]
+    ways.add(4, [9, 1])
+    assert ways.refs(4).tolist() == [9, 1] and ways.refs(7).tolist() == [1, 2]
+    assert ways.refs(5).tolist() == [] and ways.refs(6) is None
+    assert WayIndex.from_file('example.osm').refs(258219703).tolist()[:2] == [2636086179, 2636086178]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "nodes.npy")
+        index.save(path)
+        assert os.path.getsize(path) - 128 == 16 * len(index)
+        loaded = NodeCoordinateIndex.load(path)
+        assert loaded.get(261114295) == (41.9730791, -87.6866303)
+        del loaded
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    test()
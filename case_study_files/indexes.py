@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pprint
+import time
+
+from pymongo import ASCENDING, GEOSPHERE, IndexModel
+
+import cuisine as cuisine_auditor
+"""
+Indexes for the OSM collection, chosen for the queries the notebook runs:
+
+- type: the node and way counts,
+- created.user: the distinct users,
+- amenity + name: the distinct amenities, the colleges, the top amenities
+  and the top eating places,
+- cuisine: the distinct and top cuisines,
+- highway + naptan.Street: the bus stops per street,
+- name (partial, name exists): lookups by name,
+- geometry (2dsphere): the GeoJSON points added by geometry.with_geometry.
+
+The amenity and cuisine indexes are not partial: MongoDB only uses a partial
+index for a query that implies its filter, and distinct("amenity") and
+distinct("cuisine") have no filter at all.
+
+Building indexes on a loaded collection is much faster than maintaining
+them during insert_many, so loader.load creates them after the last batch:
+
+    stats = loader.load(collection, geometry.with_geometry(data.iter_map(OSMFILE)),
+                        drop=True, indexes=INDEXES)
+
+explain_queries() asks the server for the plan of every notebook query and
+reports whether it is answered from an index or by a collection scan.
+"""
+
+INDEXES = [
+    IndexModel([("type", ASCENDING)], name="type"),
+    IndexModel([("created.user", ASCENDING)], name="created_user"),
+    IndexModel([("amenity", ASCENDING), ("name", ASCENDING)], name="amenity_name"),
+    IndexModel([("cuisine", ASCENDING)], name="cuisine"),
+    IndexModel([("highway", ASCENDING), ("naptan.Street", ASCENDING)], name="highway_naptan_street"),
+    IndexModel([("name", ASCENDING)], name="name",
+               partialFilterExpression={"name": {"$exists": True}}),
+    IndexModel([("geometry", GEOSPHERE)], name="geometry_2dsphere"),
+]
+
+# The notebook's queries as explain commands (without the collection name).
+QUERIES = [
+    ("num_nodes", {"count": {"type": "node"}}),
+    ("num_ways", {"count": {"type": "way"}}),
+    ("num_unique_users", {"distinct": "created.user"}),
+    ("num_unique_amenities", {"distinct": "amenity"}),
+    ("num_unique_cuisines", {"distinct": "cuisine"}),
+    ("num_colleges", {"count": {"amenity": {"$in": ["university", "college"]}}}),
+    ("bus_stop_sample", {"find": {"naptan": {"$exists": 1}, "highway": "bus_stop"}}),
+    ("top_amenities", {"aggregate": [
+        {"$match": {"amenity": {"$exists": 1}}},
+        {"$group": {"_id": "$amenity", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": 10}
+    ]}),
+    ("top_cuisines", {"aggregate": [
+        {"$match": {"cuisine": {"$exists": 1}}},
+        {"$group": {"_id": "$cuisine", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": 10}
+    ]}),
+    ("top_eating_places", {"aggregate": [
+        {"$match": {"amenity": {"$in": cuisine_auditor.food_amenities}}},
+        {"$match": {"name": {"$exists": 1}}},
+        {"$group": {"_id": "$name", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": 10}
+    ]}),
+    ("bicycle_parking_capacity", {"aggregate": [
+        {"$match": {"amenity": "bicycle_parking"}},
+        {"$group": {"_id": "$amenity", "capacity": {"$push": "$capacity"}}}
+    ]}),
+    ("bus_stops_per_street", {"aggregate": [
+        {"$match": {"naptan": {"$exists": 1}, "highway": "bus_stop"}},
+        {"$group": {"_id": "$naptan.Street", "num_bus_stops": {"$sum": 1}}},
+        {"$sort": {"num_bus_stops": -1}},
+        {"$limit": 5}
+    ]}),
+]
+
+INDEX_STAGES = frozenset(["IXSCAN", "DISTINCT_SCAN", "COUNT_SCAN", "GEO_NEAR_2DSPHERE"])
+
+
+def ensure_indexes(collection, indexes=INDEXES):
+    """Create 'indexes' on 'collection' and return the seconds it took."""
+    start = time.time()
+    collection.create_indexes(indexes)
+    return time.time() - start
+
+
+def explain_command(collection, query):
+    kind, spec = query.items()[0]
+    if kind == "count":
+        return {"count": collection.name, "query": spec}
+    if kind == "distinct":
+        return {"distinct": collection.name, "key": spec}
+    if kind == "find":
+        return {"find": collection.name, "filter": spec}
+    if kind == "aggregate":
+        return {"aggregate": collection.name, "pipeline": spec, "cursor": {}}
+    raise ValueError("Unknown query kind: {0}".format(kind))
+
+
+def plan_stages(plan):
+    """Every 'stage' in an explain() output, outermost first."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.itervalues():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+def winning_stages(explain):
+    """The stages of the winning plan(s) only, leaving out rejected plans."""
+    if isinstance(explain, dict):
+        if "winningPlan" in explain:
+            return plan_stages(explain["winningPlan"])
+        stages = []
+        for key, value in explain.iteritems():
+            if key != "rejectedPlans":
+                stages.extend(winning_stages(value))
+        return stages
+    if isinstance(explain, list):
+        return [stage for value in explain for stage in winning_stages(value)]
+    return []
+
+
+def explain_queries(collection, queries=QUERIES):
+    """Explain every query and return {name: {"indexed", "stages", "explain"}}.
+    A query counts as indexed when its winning plan has an index stage and
+    no collection scan."""
+    database = collection.database
+    results = {}
+    for name, query in queries:
+        explain = database.command("explain", explain_command(collection, query), verbosity="queryPlanner")
+        stages = winning_stages(explain)
+        results[name] = {
+            "indexed": bool(INDEX_STAGES.intersection(stages)) and "COLLSCAN" not in stages,
+            "stages": stages,
+            "explain": explain
+        }
+    return results
+
+
+def print_explain_summary(results):
+    for name, _ in QUERIES:
+        if name in results:
+            print "{0:26} {1:9} {2}".format(name, "index" if results[name]["indexed"] else "COLLSCAN",
+                                            " <- ".join(results[name]["stages"]))
+
+
+def test():
+    import mongomock
+    collection = mongomock.MongoClient().osm.example
+    collection.insert_one({"type": "node", "geometry": {"type": "Point", "coordinates": [-1.25, 51.75]}})
+    ensure_indexes(collection)
+    pprint.pprint(sorted(collection.index_information()))
+    assert set(index.document["name"] for index in INDEXES) < set(collection.index_information())
+    # The unfiltered distinct() queries can only use non-partial indexes.
+    partial = set(index.document["name"] for index in INDEXES if "partialFilterExpression" in index.document)
+    assert partial == set(["name"])
+
+    # Abridged from a MongoDB 4.0 aggregate explain.
+    explain = {"stages": [{"$cursor": {"queryPlanner": {
+        "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "amenity_name"}},
+        "rejectedPlans": [{"stage": "COLLSCAN"}]}}},
+        {"$group": {}}]}
+    assert winning_stages(explain) == ["FETCH", "IXSCAN"]
+    assert explain_command(collection, {"distinct": "amenity"}) == {"distinct": "example", "key": "amenity"}
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Bounded string interning for the shaping pipeline.
+
+OSM data repeats the same few strings millions of times: tag keys such as
+'highway', values such as 'residential', user names, uids and versions.
+The parser hands out a new string object for every occurrence, so a list of
+shaped elements ends up holding millions of copies of each. An InternTable
+maps every string to the first equal instance it has seen, so the copies can
+be freed straight away and equal strings share one object.
+
+The builtin intern() only accepts byte strings, while ElementTree returns
+unicode for non-ASCII text, hence the dictionary. Once a table holds
+'maxsize' strings it stops admitting new ones and just passes them through,
+which bounds its memory; the common strings turn up early and are already in.
+"""
+
+INTERN_TABLE_SIZE = 200000
+
+
+class InternTable(object):
+
+    def __init__(self, maxsize=INTERN_TABLE_SIZE):
+        self.maxsize = maxsize
+        self.table = {}
+
+    def __len__(self):
+        return len(self.table)
+
+    def __call__(self, value):
+        cached = self.table.get(value)
+        if cached is not None:
+            return cached
+        if value is not None and len(self.table) < self.maxsize:
+            self.table[value] = value
+        return value
+
+    def clear(self):
+        self.table.clear()
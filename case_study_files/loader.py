@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import Queue
+import pprint
+import sys
+import threading
+import time
+
+import data as data_processor
+import indexes as index_provisioner
+"""
+Batched, pipelined MongoDB loader.
+
+Instead of building the whole 'data' list and calling insert_many once, the
+loader takes any iterable of shaped documents (for example data.iter_map or
+parallel.iter_map), groups them into batches in a background thread and
+writes each batch with an unordered insert_many on the calling thread. The
+batches go through a bounded queue, so parsing and network writes overlap
+while a slow database holds the parser back instead of letting batches
+pile up in memory.
+
+    from pymongo import MongoClient
+    collection = MongoClient("mongodb://localhost:27017").osm.oxford_england
+    stats = load(collection, data_processor.iter_map(OSMFILE), drop=True)
+
+With 'indexes' (e.g. indexes.INDEXES) the indexes are built once all the
+documents are in, which is much faster than updating them on every insert.
+"""
+
+BATCH_SIZE = 1000
+QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+def batches(documents, batch_size=BATCH_SIZE):
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _produce(documents, batch_size, queue, stop):
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    try:
+        for batch in batches(documents, batch_size):
+            if not put(batch):
+                return
+        put(_DONE)
+    except Exception:
+        put(sys.exc_info())
+
+
+def print_progress(stats):
+    print "Loaded {documents} documents in {seconds:.1f}s ({docs_per_sec:.0f} docs/s)".format(**stats)
+
+
+def load(collection, documents, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE, drop=False, report=None,
+         indexes=None):
+    """Insert 'documents' into 'collection' and return the load statistics.
+
+    'report', when given, is called with the statistics after every batch,
+    e.g. report=print_progress. 'indexes' is a list of pymongo IndexModels to
+    create after the load; the time taken is reported as 'index_seconds'.
+    """
+    if drop:
+        collection.drop()
+
+    queue = Queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    producer = threading.Thread(target=_produce, args=(documents, batch_size, queue, stop))
+    producer.daemon = True
+
+    stats = {'documents': 0, 'batches': 0, 'seconds': 0.0, 'docs_per_sec': 0.0}
+    start = time.time()
+    producer.start()
+    try:
+        while True:
+            batch = queue.get()
+            if batch is _DONE:
+                break
+            if isinstance(batch, tuple):
+                raise batch[0], batch[1], batch[2]
+            collection.insert_many(batch, ordered=False)
+            stats['documents'] += len(batch)
+            stats['batches'] += 1
+            stats['seconds'] = time.time() - start
+            if stats['seconds'] > 0:
+                stats['docs_per_sec'] = stats['documents'] / stats['seconds']
+            if report:
+                report(stats)
+    finally:
+        stop.set()
+        producer.join()
+
+    stats['seconds'] = time.time() - start
+    if stats['seconds'] > 0:
+        stats['docs_per_sec'] = stats['documents'] / stats['seconds']
+    if indexes:
+        stats['index_seconds'] = index_provisioner.ensure_indexes(collection, indexes)
+    return stats
+
+
+def test():
+    import mongomock
+    collection = mongomock.MongoClient().osm.example
+    stats = load(collection, data_processor.iter_map('example.osm'), batch_size=5, queue_size=1)
+    pprint.pprint(stats)
+    assert stats['documents'] == 22
+    assert stats['batches'] == 5
+    assert collection.count_documents({}) == 22
+    assert collection.count_documents({"type": "way"}) == 1
+
+    stats = load(collection, data_processor.iter_map('example.osm'), drop=True)
+    assert collection.count_documents({}) == 22
+
+    stats = load(collection, data_processor.iter_map('example.osm'), drop=True,
+                 indexes=index_provisioner.INDEXES)
+    assert 'index_seconds' in stats
+    assert 'amenity_name' in collection.index_information()
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A small bounded cache with least-recently-used style eviction.
+
+Python 2 has no functools.lru_cache. The OSM value and key vocabularies are
+tiny compared to the number of tags, so the hot lookups in the shaping
+pipeline are memoised with this instead.
+
+Entries live in two generations of plain dicts. A hit in the current
+generation is a single dict lookup; a hit in the previous one moves the entry
+forward. When the current generation is full the previous one is dropped, so
+at most 'maxsize' entries are kept and only entries that have not been used
+for a whole generation are evicted. This keeps the hit path as cheap as the
+lookups it is caching, which a strict LRU built on OrderedDict does not.
+"""
+
+_missing = object()
+
+
+class LRUCache(object):
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.generation_size = max(1, maxsize // 2)
+        self.current = {}
+        self.previous = {}
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+    def __contains__(self, key):
+        return key in self.current or key in self.previous
+
+    def get(self, key, default=None):
+        value = self.current.get(key, _missing)
+        if value is not _missing:
+            return value
+        value = self.previous.pop(key, _missing)
+        if value is _missing:
+            return default
+        return self.put(key, value)
+
+    def put(self, key, value):
+        if len(self.current) >= self.generation_size:
+            self.previous = self.current
+            self.current = {}
+        self.current[key] = value
+        return value
+
+    def clear(self):
+        self.current = {}
+        self.previous = {}
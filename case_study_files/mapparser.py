@@ -11,16 +11,50 @@ the map as value.
 Note that your code will be tested with a different data file than the 'example.osm'
 """
 import xml.etree.cElementTree as ET
+import mmap
 import pprint
+import re
+
+import walker
+
+# The name of an element start tag; '</', '<?' and '<!' do not match.
+start_tag = re.compile(r'<([A-Za-z_][-\w.:]*)')
 
 def count_tags(filename):
+    """Count the tags with iterparse, clearing each top level element once it
+    has been counted so that memory stays flat."""
+    tags = {}
+    context = iter(ET.iterparse(filename, events=('start', 'end')))
+    _, root = next(context)
+    for event, el in context:
+        if event == 'end':
+            if el.tag in tags:
+                tags[el.tag] += 1
+            else:
+                tags[el.tag] = 1
+            if el.tag in walker.TOP_LEVEL_TAGS:
+                root.clear()
+    return tags
+
+def count_tags_fast(filename):
+    """Count the start tags with a byte scan of the memory-mapped file,
+    without building any Element objects.
+
+    This assumes, as is the case for OSM extracts, that the file has no
+    comments or CDATA sections containing markup.
+    """
     tags = {}
-    tree = ET.parse(filename)
-    for el in tree.iter():
-        if el.tag in tags:
-            tags[el.tag] += 1
-        else:
-            tags[el.tag] = 1
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for m in start_tag.finditer(mm):
+                tag = m.group(1)
+                if tag in tags:
+                    tags[tag] += 1
+                else:
+                    tags[tag] = 1
+        finally:
+            mm.close()
     return tags
 
 def test():
@@ -35,6 +69,7 @@ def test():
                      'relation': 1,
                      'tag': 7,
                      'way': 1}
+    assert count_tags_fast('example.osm') == tags
 
 
 
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import mmap
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+from collections import Counter, deque
+
+import data as data_processor
+import walker
+import writer
+"""
+Parallel front-end for the case study parsers.
+
+The OSM file is split into byte ranges that each start on a top level
+<node>, <way> or <relation> tag. Child tags (<tag>, <nd>, <member>) never use
+those names and XML attribute values cannot contain a raw '<', so a plain
+byte search is enough to find safe split points. Every range is wrapped in
+its own <osm> root, parsed with walker.get_element in a worker process and
+run through a per-element function. Results come back in file order, so the
+output is the same as a single-threaded run whatever the number of workers.
+
+Whatever a worker returns has to be pickled, sent to the parent and
+unpickled there, one object at a time. For the shaped documents of a whole
+file that costs the parent about half as long as parsing the file did, so
+iter_map cannot get much more than twice as fast however many workers it
+has. The entry points that scale keep the per-element work in the workers
+and send back only small results:
+
+- write_map: every worker writes the JSON Lines of its own chunk with
+  writer.JSONLinesWriter, and the parent concatenates the parts in order,
+- reduce_map: every worker folds the results of its chunk with a reducer
+  (collections.Counter, sum, ...) and returns one aggregate per chunk.
+
+    write_map(OSMFILE, processes=4)              # writes OSMFILE + ".json"
+    counts = reduce_map(OSMFILE, amenity, Counter, processes=4)
+    total = sum(counts, Counter())
+
+With processes=1 everything runs in the calling process over the whole
+file, without splitting it into chunks.
+"""
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+element_start = re.compile(r'<(?:node|way|relation)[\s/>]')
+document_end = '</osm>'
+
+
+def chunk_offsets(filename, chunk_size=CHUNK_SIZE):
+    """Return (start, end) byte ranges of roughly 'chunk_size' bytes, each
+    holding only complete top level elements."""
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            first = element_start.search(mm)
+            if not first:
+                return []
+            end = mm.rfind(document_end)
+            if end == -1:
+                end = len(mm)
+            starts = [first.start()]
+            while starts[-1] + chunk_size < end:
+                m = element_start.search(mm, starts[-1] + chunk_size, end)
+                if not m:
+                    break
+                starts.append(m.start())
+        finally:
+            mm.close()
+    return zip(starts, starts[1:] + [end])
+
+
+class RangeFile(object):
+    """Read-only file object over bytes [start, end) of 'filename', wrapped in
+    an <osm> root so that it parses as a document of its own."""
+
+    def __init__(self, filename, start, end):
+        self.f = open(filename, 'rb')
+        self.f.seek(start)
+        self.remaining = end - start
+        self.pending = ['<osm>']
+        self.closed = False
+
+    def read(self, size=-1):
+        if self.pending:
+            return self.pending.pop()
+        if self.remaining <= 0:
+            if not self.closed:
+                self.closed = True
+                self.f.close()
+                return '</osm>'
+            return ''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        chunk = self.f.read(size)
+        self.remaining -= len(chunk)
+        if not chunk:
+            self.remaining = 0
+        return chunk
+
+
+def map_elements(elements, func):
+    for element in elements:
+        result = func(element)
+        if result is not None:
+            yield result
+
+
+def process_chunk(filename, start, end, func):
+    return list(map_elements(walker.get_element(RangeFile(filename, start, end)), func))
+
+
+def reduce_chunk(filename, start, end, func, reducer):
+    return reducer(map_elements(walker.get_element(RangeFile(filename, start, end)), func))
+
+
+def write_elements(elements, file_out, backend, compression, pretty):
+    """Write the shaped 'elements' to 'file_out'; return how many there were."""
+    count = 0
+    with writer.JSONLinesWriter(file_out, backend, compression, pretty) as fo:
+        for element in elements:
+            el = data_processor.shape_element(element)
+            if el:
+                fo.write(el)
+                count += 1
+    return count
+
+
+def write_chunk(filename, start, end, file_out, backend, compression, pretty):
+    return write_elements(walker.get_element(RangeFile(filename, start, end)),
+                          file_out, backend, compression, pretty)
+
+
+def run_task(task):
+    func, args = task
+    return func(*args)
+
+
+def imap_tasks(tasks, processes=None):
+    """Run the (func, args) 'tasks' in a pool of worker processes and yield
+    their results in order."""
+    pool = multiprocessing.Pool(processes)
+    try:
+        # Keep a bounded number of chunks in flight so that fast workers
+        # cannot pile up results faster than the caller consumes them.
+        window = 2 * (processes or multiprocessing.cpu_count())
+        in_flight = deque()
+        for task in tasks[:window]:
+            in_flight.append(pool.apply_async(run_task, (task,)))
+        pending = iter(tasks[window:])
+        while in_flight:
+            result = in_flight.popleft().get()
+            task = next(pending, None)
+            if task is not None:
+                in_flight.append(pool.apply_async(run_task, (task,)))
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def imap_elements(filename, func, processes=None, chunk_size=CHUNK_SIZE):
+    """Yield func(element) for every top level element of 'filename' in file
+    order, skipping None results. 'func' must be a module level function so
+    that it can be sent to the worker processes. Every result is pickled
+    back to the parent: keep them small (see reduce_map and write_map)."""
+    if processes == 1:
+        for result in map_elements(walker.get_element(filename), func):
+            yield result
+        return
+    tasks = [(process_chunk, (filename, start, end, func))
+             for start, end in chunk_offsets(filename, chunk_size)]
+    for results in imap_tasks(tasks, processes):
+        for result in results:
+            yield result
+
+
+def reduce_map(filename, func, reducer, processes=None, chunk_size=CHUNK_SIZE):
+    """Return a list with reducer(results) for every chunk of 'filename', in
+    file order, where the results are the func(element) that are not None.
+    Combining the per-chunk aggregates is up to the caller. Both functions
+    must be picklable (module level functions or types)."""
+    if processes == 1:
+        return [reducer(map_elements(walker.get_element(filename), func))]
+    tasks = [(reduce_chunk, (filename, start, end, func, reducer))
+             for start, end in chunk_offsets(filename, chunk_size)]
+    return list(imap_tasks(tasks, processes))
+
+
+def write_map(filename, file_out=None, processes=None, chunk_size=CHUNK_SIZE,
+              backend="json", compression=None, pretty=False):
+    """Parallel version of the output of data.iter_map: write the shaped
+    elements of 'filename' to 'file_out' ('<filename>.json' plus '.gz' or
+    '.zst' with 'compression' by default) and return how many there are.
+
+    Every worker writes its chunk to a part file next to 'file_out'; the
+    parts are appended to 'file_out' in file order as they complete. gzip
+    members and zstd frames can be concatenated like that, so compressed
+    output stays a single valid stream."""
+    if file_out is None:
+        file_out = "{0}.json".format(filename)
+        if compression == "gzip":
+            file_out += ".gz"
+        elif compression == "zstd":
+            file_out += ".zst"
+    if processes == 1:
+        return write_elements(walker.get_element(filename), file_out, backend, compression, pretty)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(file_out)))
+    try:
+        offsets = chunk_offsets(filename, chunk_size)
+        parts = [os.path.join(tmp_dir, "part-{0:05d}".format(i)) for i in xrange(len(offsets))]
+        tasks = [(write_chunk, (filename, start, end, part, backend, compression, pretty))
+                 for (start, end), part in zip(offsets, parts)]
+        count = 0
+        with open(file_out, "wb") as fo:
+            for i, part_count in enumerate(imap_tasks(tasks, processes)):
+                with open(parts[i], "rb") as fi:
+                    shutil.copyfileobj(fi, fo, writer.BUFFER_SIZE)
+                os.remove(parts[i])
+                count += part_count
+    finally:
+        shutil.rmtree(tmp_dir)
+    return count
+
+
+def iter_map(filename, processes=None, chunk_size=CHUNK_SIZE):
+    """Parallel version of data.iter_map, without the JSON output. Every
+    document goes through the parent process, which limits the speedup;
+    see write_map for the JSON output."""
+    for el in imap_elements(filename, data_processor.shape_element, processes, chunk_size):
+        if el:
+            yield el
+
+
+def process_map(filename, processes=None, chunk_size=CHUNK_SIZE):
+    return list(iter_map(filename, processes, chunk_size))
+
+
+def element_type(element):
+    return element.tag
+
+
+def test():
+    expected = data_processor.process_map('example.osm')
+    assert len(chunk_offsets('example.osm', 200)) > 1
+    assert process_map('example.osm', processes=1, chunk_size=200) == expected
+    assert process_map('example.osm', processes=2, chunk_size=200) == expected
+
+    with open('example.osm.json', 'rb') as f:
+        expected_json = f.read()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'example.osm.json')
+        for processes in (1, 2):
+            assert write_map('example.osm', path, processes, chunk_size=200) == len(expected)
+            with open(path, 'rb') as f:
+                assert f.read() == expected_json
+        path = os.path.join(tmp_dir, 'example.osm.json.gz')
+        write_map('example.osm', path, 2, chunk_size=200, compression='gzip')
+        assert list(writer.read_json_lines(path)) == expected
+        assert sorted(os.listdir(tmp_dir)) == ['example.osm.json', 'example.osm.json.gz']
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    counts = reduce_map('example.osm', element_type, Counter, processes=2, chunk_size=200)
+    assert len(counts) > 1
+    assert sum(counts, Counter()) == Counter(el['type'] for el in expected)
+    assert reduce_map('example.osm', element_type, Counter, processes=1) == [sum(counts, Counter())]
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import pprint
+from array import array
+
+import arrays
+import data as data_processor
+import walker
+import writer
+"""
+Compact representation of shaped elements.
+
+data.shape_element builds a nested dictionary for every element: a
+'created' sub-dictionary with five strings, a 'pos' list and a 'node_refs'
+list of decimal strings. On tens of millions of nodes those dictionaries take
+up most of the memory and most of the garbage collector's time.
+
+ShapedElement keeps the same information in a fixed set of slots instead:
+ids, versions, changesets and uids as ints, 'pos' as an array('d'),
+'node_refs' as an int64 array and the tags as a flat tuple of raw (k, v)
+strings, and the members of a relation as (type, ref, role) tuples. The
+dictionary is only built by to_dict(), when the element is
+serialised, and is the same (including key order, and so the same JSON) as
+the one data.shape_element returns.
+
+Values that would not survive the round trip to an int (such as '007') are
+simply kept as strings.
+"""
+
+
+def compact_int(value):
+    """int(value) if str() gives 'value' back, otherwise 'value' unchanged."""
+    if value is not None and value.isdigit() and str(int(value)) == value:
+        return int(value)
+    return value
+
+
+def expand_int(value):
+    if isinstance(value, (int, long)):
+        return str(value)
+    return value
+
+
+class ShapedElement(object):
+    __slots__ = ('id', 'type', 'visible', 'version', 'changeset', 'timestamp',
+                 'user', 'uid', 'pos', 'tags', 'node_refs', 'members', 'refs_at')
+
+    def to_dict(self):
+        node = {}
+        node["id"] = expand_int(self.id)
+        node["type"] = self.type
+        node["visible"] = self.visible
+        node["created"] = {
+                "version" : expand_int(self.version),
+                "changeset" : expand_int(self.changeset),
+                "timestamp" : self.timestamp,
+                "user" : self.user,
+                "uid" : expand_int(self.uid)
+            }
+        if self.pos is not None:
+            node["pos"] = [self.pos[0], self.pos[1]]
+        tags = self.tags
+        for i in xrange(0, len(tags), 2):
+            # node_refs / members go in where the first <nd> / <member> was,
+            # which matters for the key order of the dictionary.
+            if i // 2 == self.refs_at:
+                self.add_refs(node)
+            if self.type == "relation" and tags[i] == "type":
+                node["relation_type"] = tags[i + 1]
+            else:
+                data_processor.apply_tag(node, tags[i], tags[i + 1])
+        if self.refs_at is not None and self.refs_at >= len(tags) // 2:
+            self.add_refs(node)
+        return node
+
+    def add_refs(self, node):
+        if self.type == "way":
+            node["node_refs"] = self.expand_refs()
+        else:
+            node["members"] = [{"type": member_type, "ref": expand_int(ref), "role": role}
+                               for member_type, ref, role in self.members]
+
+    def expand_refs(self):
+        if isinstance(self.node_refs, array):
+            return [str(ref) for ref in self.node_refs]
+        return list(self.node_refs)
+
+    def to_json(self, pretty=False):
+        if pretty:
+            return json.dumps(self.to_dict(), indent=2)
+        return json.dumps(self.to_dict())
+
+
+def shape_element(element):
+    """Compact counterpart of data.shape_element."""
+    if element.tag != "node" and element.tag != "way" and element.tag != "relation":
+        return None
+
+    el = ShapedElement()
+    el.id = compact_int(element.get("id"))
+    el.type = element.tag
+    el.visible = data_processor.attribute_strings(element.get("visible"))
+    el.version = compact_int(element.get("version"))
+    el.changeset = compact_int(element.get("changeset"))
+    el.timestamp = element.get("timestamp")
+    el.user = data_processor.attribute_strings(element.get("user"))
+    el.uid = compact_int(element.get("uid"))
+    if element.get("lat") and element.get("lon"):
+        el.pos = array('d', (float(element.get("lat")), float(element.get("lon"))))
+    else:
+        el.pos = None
+
+    tags = []
+    refs = []
+    members = []
+    el.refs_at = None
+    for child in element:
+        key_string = child.get("k")
+        if key_string:
+            tags.append(data_processor.tag_values(key_string))
+            tags.append(data_processor.tag_values(child.get("v")))
+        elif element.tag == "way" and child.tag == "nd":
+            if el.refs_at is None:
+                el.refs_at = len(tags) // 2
+            refs.append(child.get("ref"))
+        elif element.tag == "relation" and child.tag == "member":
+            if el.refs_at is None:
+                el.refs_at = len(tags) // 2
+            members.append((data_processor.attribute_strings(child.get("type")),
+                            compact_int(child.get("ref")),
+                            data_processor.attribute_strings(child.get("role"))))
+    el.tags = tuple(tags)
+    el.members = tuple(members)
+
+    compact_refs = [compact_int(ref) for ref in refs]
+    if all(isinstance(ref, (int, long)) for ref in compact_refs):
+        el.node_refs = arrays.int64_array(compact_refs)
+    else:
+        el.node_refs = tuple(refs)
+    return el
+
+
+def iter_map(file_in):
+    """Stream the compact shaped elements of 'file_in'."""
+    for element in walker.get_element(file_in):
+        el = shape_element(element)
+        if el:
+            yield el
+
+
+def process_map(file_in, pretty=False):
+    """Like data.process_map, but keeping compact elements in memory. The
+    JSON written to '<file_in>.json' is the same."""
+    records = []
+    with writer.JSONLinesWriter("{0}.json".format(file_in), "json", None, pretty) as fo:
+        for el in iter_map(file_in):
+            records.append(el)
+            fo.write(el.to_dict())
+    return records
+
+
+def test():
+    expected = list(data_processor.iter_map('example.osm'))
+    records = process_map('example.osm')
+    pprint.pprint(records[-1].to_dict())
+    assert [el.to_dict() for el in records] == expected
+    assert [el.to_json() for el in records] == [json.dumps(el) for el in expected]
+    assert records[0].id == 261114295
+    assert list(records[-2].node_refs) == [2636086179, 2636086178, 2636086177, 2636086176]
+    assert records[-1].members[1] == ("way", 110160127, "from")
+
+
+if __name__ == "__main__":
+    test()
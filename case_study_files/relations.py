@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pprint
+
+import data as data_processor
+import geometry
+import lru
+import walker
+"""
+Geometries of relations, assembled on demand.
+
+data.shape_element keeps a relation as its list of typed members; the
+coordinates are in the member ways and nodes. RelationResolver looks them
+up in a geometry.NodeCoordinateIndex and a geometry.WayIndex when a
+relation's geometry is asked for, and caches the result per relation:
+
+- multipolygons (and boundaries) become a GeoJSON Polygon or MultiPolygon,
+  with the member ways joined end to end into the outer and inner rings,
+- routes become a MultiLineString of their member ways.
+
+The indexes can be filled in the same pass that adds the node and way
+geometries:
+
+    nodes, ways = geometry.NodeCoordinateIndex(), geometry.WayIndex()
+    documents = geometry.with_geometry(data_processor.iter_map(OSMFILE), nodes, ways)
+    ...
+    resolver = RelationResolver(nodes, ways)
+    resolver.geometry(relation)
+
+Relations with members missing from the extract, or whose ways do not close
+into rings, have no geometry (None).
+"""
+
+CACHE_SIZE = 4096
+
+AREA_TYPES = frozenset(["multipolygon", "boundary"])
+LINE_TYPES = frozenset(["route", "route_master"])
+
+_missing = object()
+
+
+def join_rings(ways):
+    """Join lists of node ids into closed rings, reversing ways as needed.
+    Returns None if some of them do not close."""
+    pending = [list(way) for way in ways if len(way) > 1]
+    rings = []
+    while pending:
+        ring = pending.pop(0)
+        while ring[0] != ring[-1]:
+            for i, way in enumerate(pending):
+                if way[0] == ring[-1]:
+                    ring.extend(way[1:])
+                elif way[-1] == ring[-1]:
+                    ring.extend(reversed(way[:-1]))
+                elif way[-1] == ring[0]:
+                    ring[:0] = way[:-1]
+                elif way[0] == ring[0]:
+                    ring[:0] = reversed(way[1:])
+                else:
+                    continue
+                del pending[i]
+                break
+            else:
+                return None
+        rings.append(ring)
+    return rings
+
+
+def contains_point(ring, point):
+    """Ray casting test of a [lon, lat] point against a ring of the same."""
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+    return inside
+
+
+class RelationResolver(object):
+
+    def __init__(self, nodes, ways, cache_size=CACHE_SIZE):
+        self.nodes = nodes
+        self.ways = ways
+        self.cache = lru.LRUCache(cache_size)
+
+    @classmethod
+    def from_file(cls, osm_file, cache_size=CACHE_SIZE):
+        """Index the nodes and ways of an OSM file in one pass."""
+        nodes, ways = geometry.NodeCoordinateIndex(), geometry.WayIndex()
+        for element in walker.get_element(osm_file, tags=("node", "way")):
+            if element.tag == "node":
+                lat, lon = element.get("lat"), element.get("lon")
+                if lat and lon and geometry.point_geometry([float(lat), float(lon)]) is not None:
+                    nodes.add(int(element.get("id")), float(lat), float(lon))
+            else:
+                ways.add(int(element.get("id")), [int(nd.get("ref")) for nd in element.iter("nd")])
+        nodes.finish().complete = True
+        ways.finish().complete = True
+        return cls(nodes, ways, cache_size)
+
+    def member_ways(self, relation, roles=None):
+        """The node ids of the way members (with one of 'roles'), or None if
+        one of them is not in the way index."""
+        ways = []
+        for member in relation.get("members") or ():
+            if member.get("type") != "way" or (roles is not None and member.get("role") not in roles):
+                continue
+            refs = self.ways.refs(int(member["ref"]))
+            if refs is None:
+                return None
+            ways.append(refs.tolist())
+        return ways
+
+    def area_geometry(self, relation):
+        outer_ways = self.member_ways(relation, ("outer", ""))
+        inner_ways = self.member_ways(relation, ("inner",))
+        if not outer_ways or inner_ways is None:
+            return None
+        outer_rings, inner_rings = join_rings(outer_ways), join_rings(inner_ways)
+        if not outer_rings or inner_rings is None:
+            return None
+        polygons = []
+        for ring in outer_rings:
+            coordinates = geometry.node_coordinates(ring, self.nodes)
+            if coordinates is None or len(coordinates) < 4:
+                return None
+            polygons.append([coordinates])
+        for ring in inner_rings:
+            coordinates = geometry.node_coordinates(ring, self.nodes)
+            if coordinates is None or len(coordinates) < 4:
+                return None
+            for polygon in polygons:
+                if contains_point(polygon[0], coordinates[0]):
+                    polygon.append(coordinates)
+                    break
+        if len(polygons) == 1:
+            return {"type": "Polygon", "coordinates": polygons[0]}
+        return {"type": "MultiPolygon", "coordinates": polygons}
+
+    def line_geometry(self, relation):
+        lines = []
+        for refs in self.member_ways(relation) or ():
+            coordinates = geometry.node_coordinates(refs, self.nodes)
+            if coordinates is not None and len(coordinates) > 1:
+                lines.append(coordinates)
+        if not lines:
+            return None
+        return {"type": "MultiLineString", "coordinates": lines}
+
+    def geometry(self, relation):
+        """GeoJSON geometry of a shaped relation, or None."""
+        key = relation.get("id")
+        cached = self.cache.get(key, _missing)
+        if cached is not _missing:
+            return cached
+        relation_type = relation.get("relation_type")
+        if relation_type in AREA_TYPES:
+            result = self.area_geometry(relation)
+        elif relation_type in LINE_TYPES:
+            result = self.line_geometry(relation)
+        else:
+            result = None
+        return self.cache.put(key, result)
+
+
+def test():
+    nodes = geometry.NodeCoordinateIndex()
+    # A 4x4 square with a 2x2 hole, its outer ring split over two ways.
+    for node_id, lat, lon in [(1, 0, 0), (2, 0, 4), (3, 4, 4), (4, 4, 0),
+                              (5, 1, 1), (6, 1, 3), (7, 3, 3), (8, 3, 1)]:
+        nodes.add(node_id, lat, lon)
+    ways = geometry.WayIndex()
+    ways.add(10, [1, 2, 3])
+    ways.add(11, [1, 4, 3])
+    ways.add(12, [5, 6, 7, 8, 5])
+    resolver = RelationResolver(nodes, ways)
+
+    multipolygon = {"id": "100", "type": "relation", "relation_type": "multipolygon", "members": [
+        {"type": "way", "ref": "10", "role": "outer"},
+        {"type": "way", "ref": "11", "role": "outer"},
+        {"type": "way", "ref": "12", "role": "inner"}]}
+    result = resolver.geometry(multipolygon)
+    pprint.pprint(result)
+    assert result["type"] == "Polygon"
+    assert result["coordinates"][0] == [[0.0, 0.0], [4.0, 0.0], [4.0, 4.0], [0.0, 4.0], [0.0, 0.0]]
+    assert len(result["coordinates"][1]) == 5
+    assert resolver.geometry(multipolygon) is result
+
+    route = {"id": "101", "type": "relation", "relation_type": "route", "members": [
+        {"type": "node", "ref": "1", "role": "stop"},
+        {"type": "way", "ref": "10", "role": ""}]}
+    assert resolver.geometry(route) == {"type": "MultiLineString",
+                                        "coordinates": [[[0.0, 0.0], [4.0, 0.0], [4.0, 4.0]]]}
+
+    unclosed = dict(multipolygon, id="102", members=multipolygon["members"][:1])
+    assert resolver.geometry(unclosed) is None
+
+    relation = data_processor.process_map('example.osm')[-1]
+    assert RelationResolver.from_file('example.osm').geometry(relation) is None
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+import pprint
+import zlib
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+import numpy as np
+
+import spatial
+"""
+Name similarity between food nodes, for suggesting missing cuisines.
+
+The notebook compares the name of one node with the name of every food node
+of the same amenity using difflib.SequenceMatcher, which is far too slow to
+run for every node without a cuisine on a larger extract. NameIndex finds
+the candidates with locality sensitive hashing instead:
+
+- names are normalised the way the notebook does it and cut into character
+  n-grams,
+- every name gets a MinHash signature, split into bands; names that agree
+  on any band land in the same bucket,
+- a query only scores the names sharing a bucket with it, with the same
+  SequenceMatcher ratio as the notebook.
+
+    index = NameIndex(cuisine.audit(OSMFILE))
+    index.similar(subject, k=5)                  # [(score, node), ...]
+    infer_cuisines(food_nodes, index)            # [(node, cuisine, score), ...]
+
+With 'distance_weight' set, the score mixes in how close the two nodes are
+(exp(-distance / distance_scale), distance in metres), so that a namesake
+around the corner counts for more than one across the country.
+"""
+
+NGRAM = 3
+NUM_PERM = 64
+BANDS = 16
+DISTANCE_SCALE = 1000.0
+
+
+def normalise_name(name):
+    return name.replace('the', '').lower()
+
+
+def similarity_by_name(a, b):
+    """The notebook's similarity of two food nodes."""
+    if 'name' in a and 'name' in b:
+        return SequenceMatcher(None, normalise_name(a['name']), normalise_name(b['name'])).ratio()
+    return 0
+
+
+def shingles(text, n=NGRAM):
+    """Hashes of the character n-grams of 'text', padded at both ends."""
+    text = u" {0} ".format(text.strip())
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    grams = set(text[i:i + n] for i in xrange(max(len(text) - n + 1, 1)))
+    return np.array([zlib.crc32(gram) & 0xffffffff for gram in grams], dtype=np.uint64)
+
+
+class NameIndex(object):
+
+    def __init__(self, nodes, num_perm=NUM_PERM, bands=BANDS, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        rng = np.random.RandomState(seed)
+        # Multiply-shift hashing: (a * x + b) >> 32 with odd 64 bit 'a'.
+        self.a = rng.randint(0, 1 << 62, size=num_perm).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.randint(0, 1 << 62, size=num_perm).astype(np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets = [defaultdict(list) for _ in xrange(bands)]
+        self.nodes = []
+        self.names = []
+        for node in nodes:
+            name = node.get('name')
+            if isinstance(name, basestring):
+                self.add(node, name)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def signature(self, name):
+        hashes = shingles(normalise_name(name))
+        with np.errstate(over='ignore'):
+            values = (self.a[:, None] * hashes[None, :] + self.b[:, None]) >> np.uint64(32)
+        return values.min(axis=1)
+
+    def band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tostring() for i in xrange(self.bands)]
+
+    def add(self, node, name):
+        position = len(self.nodes)
+        self.nodes.append(node)
+        self.names.append(normalise_name(name))
+        for bucket, key in zip(self.buckets, self.band_keys(self.signature(name))):
+            bucket[key].append(position)
+
+    def candidates(self, name):
+        positions = set()
+        for bucket, key in zip(self.buckets, self.band_keys(self.signature(name))):
+            positions.update(bucket.get(key, ()))
+        return positions
+
+    def similar(self, subject, k=5, same_amenity=True, with_cuisine=False,
+                distance_weight=0.0, distance_scale=DISTANCE_SCALE):
+        """The 'k' nodes most similar to 'subject', as (score, node) pairs,
+        best first. The subject itself is left out."""
+        name = subject.get('name')
+        if not isinstance(name, basestring):
+            return []
+        normalised = normalise_name(name)
+        matcher = SequenceMatcher(None, normalised)
+        pos = subject.get('pos')
+        results = []
+        for position in self.candidates(name):
+            node = self.nodes[position]
+            if node is subject or (subject.get('id') is not None and node.get('id') == subject.get('id')):
+                continue
+            if same_amenity and node.get('amenity') != subject.get('amenity'):
+                continue
+            if with_cuisine and 'cuisine' not in node:
+                continue
+            matcher.set_seq2(self.names[position])
+            score = matcher.ratio()
+            if distance_weight:
+                other = node.get('pos')
+                closeness = 0.0
+                if pos and other:
+                    distance = spatial.haversine(pos[0], pos[1], np.array([other[0]]), np.array([other[1]]))[0]
+                    closeness = math.exp(-distance / distance_scale)
+                score = (1 - distance_weight) * score + distance_weight * closeness
+            results.append((score, position))
+        results.sort(key=lambda result: (-result[0], result[1]))
+        return [(score, self.nodes[position]) for score, position in results[:k]]
+
+
+def infer_cuisines(food_nodes, index=None, k=5, min_score=0.6, **kwargs):
+    """Suggest a cuisine for every named food node with an amenity but no
+    cuisine: the cuisine with the highest total score among its 'k' most
+    similar nodes that have one, if that total reaches 'min_score'. Returns
+    a list of (node, cuisine, score)."""
+    if index is None:
+        index = NameIndex(food_nodes)
+    suggestions = []
+    for node in food_nodes:
+        if 'cuisine' in node or 'amenity' not in node or 'name' not in node:
+            continue
+        votes = defaultdict(float)
+        for score, other in index.similar(node, k, with_cuisine=True, **kwargs):
+            if isinstance(other['cuisine'], basestring):
+                votes[other['cuisine']] += score
+        if votes:
+            cuisine, score = max(votes.iteritems(), key=lambda vote: (vote[1], vote[0]))
+            if score >= min_score:
+                suggestions.append((node, cuisine, score))
+    return suggestions
+
+
+def test():
+    food_nodes = [
+        {'id': '1', 'name': 'The Eagle and Child', 'amenity': 'pub', 'cuisine': 'british', 'pos': [51.757, -1.260]},
+        {'id': '2', 'name': 'Eagle & Child', 'amenity': 'pub', 'pos': [51.757, -1.261]},
+        {'id': '3', 'name': 'Pizza Express', 'amenity': 'restaurant', 'cuisine': 'pizza', 'pos': [51.752, -1.255]},
+        {'id': '4', 'name': 'Pizza Express', 'amenity': 'restaurant', 'cuisine': 'pizza', 'pos': [51.500, -0.120]},
+        {'id': '5', 'name': 'Pizza Expresso', 'amenity': 'restaurant', 'pos': [51.751, -1.254]},
+        {'id': '6', 'name': 'Taj Mahal', 'amenity': 'restaurant', 'cuisine': 'indian', 'pos': [51.760, -1.250]},
+        {'id': '7', 'name': 'The Turf Tavern', 'amenity': 'pub', 'pos': [51.755, -1.252]},
+        {'id': '8', 'name': 'Eagle & Child', 'amenity': 'cafe', 'cuisine': 'coffee_shop'},
+        {'id': '9', 'amenity': 'cafe'},
+    ]
+    index = NameIndex(food_nodes)
+    assert len(index) == 8
+
+    # The candidates hold the names the notebook's scan ranks highest.
+    subject = food_nodes[4]
+    brute_force = sorted(((-similarity_by_name(subject, node), node['id']) for node in food_nodes
+                          if node is not subject and node.get('amenity') == subject['amenity']
+                          and 'name' in node))
+    results = index.similar(subject, k=2)
+    pprint.pprint(results)
+    assert [(-score, node['id']) for score, node in results] == brute_force[:2]
+    assert index.similar(food_nodes[1], same_amenity=False, k=1)[0][1]['id'] == '8'
+
+    # Both 'Pizza Express' score the same on the name; distance decides.
+    nearby = index.similar(subject, k=2, distance_weight=0.5)
+    assert [node['id'] for _, node in nearby] == ['3', '4']
+
+    suggestions = infer_cuisines(food_nodes, index)
+    assert [(node['id'], cuisine) for node, cuisine, _ in suggestions] == [('2', 'british'), ('5', 'pizza')]
+
+
+if __name__ == "__main__":
+    test()
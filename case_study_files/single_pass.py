@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pprint
+from collections import defaultdict
+
+import audit as street_name_auditor
+import cuisine as cuisine_auditor
+import data as data_processor
+import tags as tags_processor
+import walker
+import writer
+"""
+The notebook audits the OSM file with tags.process_map, tags.unique_tag_keys,
+audit.audit, cuisine.audit and data.process_map, and each of them parses the
+whole file again. This module walks the file once and hands every top level
+element to a set of visitors, one per audit, then returns all of their
+results together.
+
+A visitor is any object with a 'name', a 'visit(element)' method that is
+called with each complete top level element, and a 'result()' method that is
+called once the walk is over. Elements are cleared after all visitors have
+seen them, so visitors must copy anything they want to keep.
+
+    results = run(OSMFILE, default_visitors())
+    results['key_types']['counts']
+"""
+
+
+class KeyTypeVisitor(object):
+    """Same result as tags.process_map."""
+    name = 'key_types'
+
+    def __init__(self):
+        self.counts = dict((key_type, 0) for key_type in tags_processor.KEY_TYPES)
+        self.keys = dict((key_type, []) for key_type in tags_processor.KEY_TYPES)
+
+    def visit(self, element):
+        for tag in element.iter("tag"):
+            tags_processor.key_type(tag.get("k"), self.counts, self.keys)
+
+    def result(self):
+        return {'counts': self.counts, 'keys': self.keys}
+
+
+class UniqueKeysVisitor(object):
+    """Same result as tags.unique_tag_keys."""
+    name = 'unique_keys'
+
+    def __init__(self):
+        self.keys = set()
+
+    def visit(self, element):
+        for tag in element.iter("tag"):
+            self.keys.add(tag.get("k"))
+
+    def result(self):
+        return self.keys
+
+
+class StreetTypeVisitor(object):
+    """Same result as audit.audit."""
+    name = 'street_types'
+
+    def __init__(self):
+        self.street_types = defaultdict(set)
+
+    def visit(self, element):
+        for name in street_name_auditor.street_names(element) or ():
+            street_name_auditor.audit_street_type(self.street_types, name)
+
+    def result(self):
+        return self.street_types
+
+
+class FoodNodeVisitor(object):
+    """Same result as cuisine.audit."""
+    name = 'food_nodes'
+
+    def __init__(self):
+        self.food_nodes = []
+
+    def visit(self, element):
+        node = cuisine_auditor.food_node(element)
+        if node:
+            self.food_nodes.append(node)
+
+    def result(self):
+        return self.food_nodes
+
+
+class UserVisitor(object):
+    """Same result as users.process_map."""
+    name = 'users'
+
+    def __init__(self):
+        self.users = set()
+
+    def visit(self, element):
+        u = element.get('user')
+        if u:
+            self.users.add(u)
+
+    def result(self):
+        return self.users
+
+
+class ShapeVisitor(object):
+    """Same result as data.process_map.
+
+    With 'file_out' set the shaped elements are also written there as JSON,
+    and with 'keep' set to False they are only written, which keeps memory
+    flat on large files; the result is then the number of elements written.
+    """
+    name = 'shaped'
+
+    def __init__(self, file_out=None, pretty=False, keep=True, backend="json"):
+        self.fo = writer.JSONLinesWriter(file_out, backend, pretty=pretty) if file_out else None
+        self.keep = keep
+        self.data = []
+        self.count = 0
+
+    def visit(self, element):
+        el = data_processor.shape_element(element)
+        if el:
+            self.count += 1
+            if self.keep:
+                self.data.append(el)
+            if self.fo:
+                self.fo.write(el)
+
+    def result(self):
+        if self.fo:
+            self.fo.close()
+            self.fo = None
+        if self.keep:
+            return self.data
+        return self.count
+
+
+def default_visitors(file_out=None, pretty=False, keep=True):
+    return [KeyTypeVisitor(), UniqueKeysVisitor(), StreetTypeVisitor(),
+            FoodNodeVisitor(), UserVisitor(), ShapeVisitor(file_out, pretty, keep)]
+
+
+def run(filename, visitors):
+    """Walk 'filename' once, feeding every visitor, and return a dictionary
+    of each visitor's name to its result."""
+    for element in walker.get_element(filename):
+        for visitor in visitors:
+            visitor.visit(element)
+    return dict((visitor.name, visitor.result()) for visitor in visitors)
+
+
+def test():
+    results = run('example.osm', default_visitors())
+    pprint.pprint(results['key_types']['counts'])
+    assert results['key_types'] == tags_processor.process_map('example.osm')
+    assert results['unique_keys'] == tags_processor.unique_tag_keys('example.osm')
+    assert results['shaped'] == data_processor.process_map('example.osm')
+    assert len(results['users']) == 6
+    assert results['food_nodes'] == cuisine_auditor.audit('example.osm')
+    assert results['street_types'] == street_name_auditor.audit('example.osm')
+
+
+if __name__ == "__main__":
+    test()
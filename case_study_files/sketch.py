@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import heapq
+"""
+Space-Saving top-K counter (Metwally, Agrawal and El Abbadi, 2005).
+
+Keeps at most 'capacity' items. When a new item arrives and the table is
+full, the item with the smallest count is replaced and the newcomer inherits
+that count (recorded as its possible overestimation in 'errors'). Any item
+whose true count is above total / capacity is guaranteed to be in the table,
+so the heavy hitters of an unbounded stream are found in bounded memory.
+
+The interface follows collections.Counter where it makes sense.
+"""
+
+
+class SpaceSaving(object):
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        # Min-heap of (count, item); entries go stale when an item's count
+        # changes and are skipped when popped.
+        self.heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __getitem__(self, item):
+        return self.counts.get(item, 0)
+
+    def add(self, item, count=1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            smallest = self._pop_smallest()
+            floor = self.counts.pop(smallest)
+            del self.errors[smallest]
+            self.counts[item] = floor + count
+            self.errors[item] = floor
+        heapq.heappush(self.heap, (self.counts[item], item))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(c, i) for i, c in self.counts.iteritems()]
+            heapq.heapify(self.heap)
+
+    def _pop_smallest(self):
+        while True:
+            count, item = heapq.heappop(self.heap)
+            if self.counts.get(item) == count:
+                return item
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def most_common(self, n=None):
+        items = sorted(self.counts.iteritems(), key=lambda item: item[1], reverse=True)
+        return items if n is None else items[:n]
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+import os
+import pprint
+import shutil
+import tempfile
+
+import numpy as np
+
+import data as data_processor
+"""
+In-process spatial index over the positions of the shaped nodes.
+
+The nodes are bucketed into a uniform grid of 'cell_size' degree cells.
+Points are stored sorted by cell, with the offset of every cell's first
+point (a CSR layout), so the points of a row of neighbouring cells are one
+contiguous slice of the arrays and a query touches a handful of slices:
+
+    grid = GridIndex.from_documents(data_processor.iter_map(OSMFILE))
+    grid.nearest(51.752, -1.258, k=5, amenity="pub")   # [(id, metres), ...]
+    grid.bbox(51.74, -1.27, 51.76, -1.24, amenity="bicycle_parking")
+
+Nearest neighbour queries search rings of cells around the query point and
+stop once no unsearched cell can be closer than the k-th best match. The
+points of one amenity are indexed separately (on first use), so a query
+for a rare amenity does not scan all the other nodes on the way. Distances
+are great circle distances in metres.
+
+The index is built once per dataset and saved with numpy:
+
+    grid.save("oxford_england.grid.npz")
+    grid = GridIndex.load("oxford_england.grid.npz")
+"""
+
+EARTH_RADIUS = 6371008.8
+METRES_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+POINTS_PER_CELL = 16
+
+
+def haversine(lat, lon, lats, lons):
+    """Distances in metres from (lat, lon) to the points (lats, lons)."""
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex(object):
+
+    def __init__(self, ids, lats, lons, amenities, categories, origin, cell_size, shape):
+        """Index the points (ids, lats, lons); 'amenities' are codes into
+        'categories' (-1 for none). Use from_documents() or load() instead."""
+        self.origin = origin
+        self.cell_size = cell_size
+        self.rows, self.cols = shape
+        self.categories = list(categories)
+        self.category_codes = dict((name, code) for code, name in enumerate(self.categories))
+        cells = self.cell_of(lats, lons)
+        order = np.argsort(cells, kind="mergesort")
+        self.cells = cells[order]
+        self.ids = ids[order]
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.amenities = amenities[order]
+        self.starts = np.searchsorted(self.cells, np.arange(self.rows * self.cols + 1))
+        self.subsets = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_documents(cls, documents, cell_size=None):
+        """Index the nodes with a 'pos' among the shaped 'documents'. Without
+        a 'cell_size' it is chosen for about POINTS_PER_CELL nodes per cell."""
+        ids, lats, lons, amenities = [], [], [], []
+        categories = {}
+        for el in documents:
+            pos = el.get("pos")
+            if el.get("type") != "node" or not pos:
+                continue
+            try:
+                ids.append(int(el["id"]))
+            except ValueError:
+                continue
+            lats.append(pos[0])
+            lons.append(pos[1])
+            amenity = el.get("amenity")
+            if isinstance(amenity, basestring):
+                amenities.append(categories.setdefault(amenity, len(categories)))
+            else:
+                amenities.append(-1)
+        ids = np.array(ids, dtype=np.int64)
+        lats = np.array(lats, dtype=np.float64)
+        lons = np.array(lons, dtype=np.float64)
+        if len(ids):
+            min_lat, max_lat, min_lon, max_lon = lats.min(), lats.max(), lons.min(), lons.max()
+        else:
+            min_lat = max_lat = min_lon = max_lon = 0.0
+        if cell_size is None:
+            area = max(max_lat - min_lat, 1e-6) * max(max_lon - min_lon, 1e-6)
+            cell_size = math.sqrt(area * POINTS_PER_CELL / max(len(ids), 1))
+        shape = (int((max_lat - min_lat) / cell_size) + 1, int((max_lon - min_lon) / cell_size) + 1)
+        names = sorted(categories, key=categories.get)
+        return cls(ids, lats, lons, np.array(amenities, dtype=np.int32), names,
+                   (min_lat, min_lon), cell_size, shape)
+
+    def cell_of(self, lats, lons):
+        rows = np.clip(((lats - self.origin[0]) / self.cell_size).astype(np.int64), 0, self.rows - 1)
+        cols = np.clip(((lons - self.origin[1]) / self.cell_size).astype(np.int64), 0, self.cols - 1)
+        return rows * self.cols + cols
+
+    def subset(self, amenity):
+        """The index of the nodes with one amenity, built on first use."""
+        if amenity is None:
+            return self
+        subset = self.subsets.get(amenity)
+        if subset is None:
+            code = self.category_codes.get(amenity, -2)
+            mask = self.amenities == code
+            # Coarser cells for fewer points, over the same extent.
+            height, width = self.rows * self.cell_size, self.cols * self.cell_size
+            cell_size = max(self.cell_size, math.sqrt(height * width * POINTS_PER_CELL / max(mask.sum(), 1)))
+            shape = (int(height / cell_size) + 1, int(width / cell_size) + 1)
+            subset = GridIndex(self.ids[mask], self.lats[mask], self.lons[mask], self.amenities[mask],
+                               self.categories, self.origin, cell_size, shape)
+            self.subsets[amenity] = subset
+        return subset
+
+    def _row_slices(self, row, col_start, col_end):
+        """Point positions in cells [col_start, col_end] of 'row', clipped to
+        the grid."""
+        if row < 0 or row >= self.rows:
+            return None
+        col_start, col_end = max(col_start, 0), min(col_end, self.cols - 1)
+        if col_start > col_end:
+            return None
+        return slice(self.starts[row * self.cols + col_start], self.starts[row * self.cols + col_end + 1])
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon, amenity=None):
+        """Ids of the nodes (with 'amenity') inside the bounding box."""
+        index = self.subset(amenity)
+        row_start = int(math.floor((min_lat - index.origin[0]) / index.cell_size))
+        row_end = int(math.floor((max_lat - index.origin[0]) / index.cell_size))
+        col_start = int(math.floor((min_lon - index.origin[1]) / index.cell_size))
+        col_end = int(math.floor((max_lon - index.origin[1]) / index.cell_size))
+        parts = []
+        for row in xrange(max(row_start, 0), min(row_end, index.rows - 1) + 1):
+            part = index._row_slices(row, col_start, col_end)
+            if part is not None and part.start < part.stop:
+                lats, lons = index.lats[part], index.lons[part]
+                inside = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+                parts.append(index.ids[part][inside])
+        if not parts:
+            return []
+        return np.concatenate(parts).tolist()
+
+    def nearest(self, lat, lon, k=1, amenity=None):
+        """The 'k' nodes (with 'amenity') nearest to (lat, lon), as a list of
+        (id, metres), nearest first."""
+        index = self.subset(amenity)
+        if not len(index) or k < 1:
+            return []
+        row = int(math.floor((lat - index.origin[0]) / index.cell_size))
+        col = int(math.floor((lon - index.origin[1]) / index.cell_size))
+        max_ring = max(abs(row), abs(index.rows - 1 - row), abs(col), abs(index.cols - 1 - col))
+        best_positions = np.empty(0, dtype=np.int64)
+        best_distances = np.empty(0)
+        ring = 0
+        while ring <= max_ring:
+            if ring == 0:
+                parts = [index._row_slices(row, col, col)]
+            else:
+                parts = [index._row_slices(row - ring, col - ring, col + ring),
+                         index._row_slices(row + ring, col - ring, col + ring)]
+                for side_row in xrange(max(row - ring + 1, 0), min(row + ring - 1, index.rows - 1) + 1):
+                    parts.append(index._row_slices(side_row, col - ring, col - ring))
+                    parts.append(index._row_slices(side_row, col + ring, col + ring))
+            positions = [np.arange(part.start, part.stop) for part in parts
+                         if part is not None and part.start < part.stop]
+            if positions:
+                positions = np.concatenate([best_positions] + positions)
+                distances = np.concatenate((best_distances, haversine(
+                    lat, lon, index.lats[positions[len(best_positions):]],
+                    index.lons[positions[len(best_positions):]])))
+                keep = np.argsort(distances, kind="mergesort")[:k]
+                best_positions, best_distances = positions[keep], distances[keep]
+            if len(best_positions) == k:
+                # Every point outside the searched rings is at least 'ring'
+                # cells away, in latitude or (narrowing towards the poles)
+                # in longitude.
+                latitude = min(abs(lat) + (ring + 1) * index.cell_size, 90.0)
+                bound = ring * index.cell_size * METRES_PER_DEGREE * math.cos(math.radians(latitude))
+                if best_distances[-1] <= bound:
+                    break
+            ring += 1
+        return [(int(node_id), float(distance))
+                for node_id, distance in zip(index.ids[best_positions], best_distances)]
+
+    def save(self, path):
+        np.savez(path, ids=self.ids, lats=self.lats, lons=self.lons, amenities=self.amenities,
+                 categories=np.array(self.categories, dtype=np.unicode_),
+                 grid=np.array([self.origin[0], self.origin[1], self.cell_size, self.rows, self.cols]))
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        min_lat, min_lon, cell_size, rows, cols = arrays["grid"].tolist()
+        return cls(arrays["ids"], arrays["lats"], arrays["lons"], arrays["amenities"],
+                   arrays["categories"].tolist(), (min_lat, min_lon), cell_size, (int(rows), int(cols)))
+
+
+def test():
+    documents = data_processor.process_map('example.osm')
+    rng = np.random.RandomState(1)
+    for i in xrange(2000):
+        documents.append({"id": str(i), "type": "node",
+                          "pos": [51.7 + rng.rand() * 0.1, -1.3 + rng.rand() * 0.1],
+                          "amenity": ["pub", "cafe", "bench", {"disused": "pub"}][i % 4] if i % 3 else None})
+    grid = GridIndex.from_documents(documents)
+    nodes = [el for el in documents if el["type"] == "node"]
+    assert len(grid) == len(nodes)
+
+    def brute_force(lat, lon, k, amenity=None):
+        candidates = [el for el in nodes if amenity is None or el.get("amenity") == amenity]
+        distances = haversine(lat, lon, np.array([el["pos"][0] for el in candidates]),
+                              np.array([el["pos"][1] for el in candidates]))
+        return [int(candidates[i]["id"]) for i in np.argsort(distances, kind="mergesort")[:k]]
+
+    for lat, lon in [(51.75, -1.25), (51.71, -1.29), (52.5, -1.0), (41.9730, -87.6870)]:
+        for amenity in (None, "pub", "cafe"):
+            result = grid.nearest(lat, lon, 5, amenity)
+            assert [node_id for node_id, _ in result] == brute_force(lat, lon, 5, amenity), (lat, lon, amenity)
+    pprint.pprint(grid.nearest(51.75, -1.25, 3, "cafe"))
+    assert grid.nearest(51.75, -1.25, 3, "library") == []
+
+    expected = sorted(int(el["id"]) for el in nodes
+                      if 51.72 <= el["pos"][0] <= 51.74 and -1.28 <= el["pos"][1] <= -1.25
+                      and el.get("amenity") == "pub")
+    assert sorted(grid.bbox(51.72, -1.28, 51.74, -1.25, amenity="pub")) == expected
+    assert len(grid.bbox(0, -180, 90, 180)) == len(nodes)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "grid.npz")
+        grid.save(path)
+        loaded = GridIndex.load(path)
+        assert loaded.nearest(51.75, -1.25, 5, "pub") == grid.nearest(51.75, -1.25, 5, "pub")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import mmap
+import os
+import pprint
+import re
+import time
+
+from pymongo import DeleteMany, ReplaceOne
+
+import arrays
+import data as data_processor
+import parallel
+import walker
+"""
+Incremental, idempotent reload of an OSM file into a MongoDB collection.
+
+The notebook compares collection.count() with len(data) and reloads
+everything on any mismatch, which needs a full parse first. sync() instead
+keeps a small manifest next to the OSM file (the file size, mtime and SHA-1
+plus one checksum per chunk) and:
+
+- returns straight away when the file is unchanged,
+- only parses the chunks whose checksum is not in the previous manifest,
+- upserts only the elements whose created.version changed, keyed on
+  the type/id pair, and
+- deletes the elements that are no longer in the file.
+
+Chunks start at top level elements whose id is a multiple of 'anchor_every'
+(plus the very first element). Because the split points depend on the
+content rather than on byte offsets, an edit only changes the checksum of
+the chunk it falls in and the rest of the file is skipped.
+
+    stats = sync(collection, OSMFILE)
+"""
+
+ANCHOR_EVERY = 4096
+BATCH_SIZE = 1000
+MANIFEST_VERSION = 2
+
+element_id = re.compile(r'<(node|way|relation)\s[^>]*?\bid="(-?\d+)"')
+
+
+def manifest_file(file_in):
+    return "{0}.manifest.json".format(file_in)
+
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.rename(tmp, path)
+
+
+def scan(file_in, anchor_every=ANCHOR_EVERY):
+    """Split 'file_in' into content-defined chunks with a byte scan.
+
+    Returns the file SHA-1, a list of (start, end, checksum) chunks and the
+    sorted ids of every top level element, as one int64 array per type.
+    """
+    ids = dict((tag, arrays.int64_array()) for tag in walker.TOP_LEVEL_TAGS)
+    file_hash = hashlib.sha1()
+    chunks = []
+    with open(file_in, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return file_hash.hexdigest(), chunks, ids
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            end = mm.rfind(parallel.document_end)
+            if end == -1:
+                end = len(mm)
+            starts = []
+            for m in element_id.finditer(mm, 0, end):
+                element_id_value = int(m.group(2))
+                ids[m.group(1)].append(element_id_value)
+                if not starts or element_id_value % anchor_every == 0:
+                    starts.append(m.start())
+
+            file_hash.update(mm[0:starts[0] if starts else end])
+            for start, stop in zip(starts, starts[1:] + [end]):
+                chunk = mm[start:stop]
+                file_hash.update(chunk)
+                chunks.append((start, stop, hashlib.sha1(chunk).hexdigest()))
+            file_hash.update(mm[end:])
+        finally:
+            mm.close()
+
+    for tag in ids:
+        ids[tag] = arrays.int64_array(sorted(ids[tag]))
+    return file_hash.hexdigest(), chunks, ids
+
+
+def _upsert_changed(collection, docs):
+    """Replace the documents of 'docs' whose version differs from the one
+    stored in 'collection' and return how many were written."""
+    by_type = {}
+    for doc in docs:
+        by_type.setdefault(doc["type"], []).append(doc["id"])
+    stored = {}
+    for tag, element_ids in by_type.iteritems():
+        for doc in collection.find({"type": tag, "id": {"$in": element_ids}},
+                                   {"_id": 0, "type": 1, "id": 1, "created.version": 1}):
+            stored[(doc["type"], doc["id"])] = doc.get("created", {}).get("version")
+
+    requests = []
+    for doc in docs:
+        key = (doc["type"], doc["id"])
+        if key not in stored or stored[key] != doc["created"]["version"]:
+            requests.append(ReplaceOne({"type": doc["type"], "id": doc["id"]}, doc, upsert=True))
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+    return len(requests)
+
+
+def _delete_missing(collection, ids, batch_size=BATCH_SIZE):
+    """Delete the documents whose type/id pair is not in 'ids'."""
+    missing = dict((tag, []) for tag in ids)
+    deleted = 0
+    for doc in collection.find({}, {"_id": 0, "type": 1, "id": 1}):
+        tag = doc.get("type")
+        if tag not in ids:
+            continue
+        try:
+            element_id_value = int(doc.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if not arrays.contains(ids[tag], element_id_value):
+            missing[tag].append(doc["id"])
+    requests = []
+    for tag, element_ids in missing.iteritems():
+        for i in range(0, len(element_ids), batch_size):
+            requests.append(DeleteMany({"type": tag, "id": {"$in": element_ids[i:i + batch_size]}}))
+            deleted += len(element_ids[i:i + batch_size])
+    if requests:
+        collection.bulk_write(requests, ordered=False)
+    return deleted
+
+
+def sync(collection, file_in, manifest_path=None, anchor_every=ANCHOR_EVERY, batch_size=BATCH_SIZE):
+    """Bring 'collection' in line with 'file_in' and return what was done."""
+    start_time = time.time()
+    manifest_path = manifest_path or manifest_file(file_in)
+    manifest = read_manifest(manifest_path)
+    if manifest and (manifest.get("version") != MANIFEST_VERSION
+                     or manifest.get("collection") != collection.full_name
+                     or manifest.get("anchor_every") != anchor_every):
+        manifest = None
+
+    stats = {"skipped": False, "chunks": 0, "changed_chunks": 0, "upserted": 0, "deleted": 0}
+    st = os.stat(file_in)
+    if manifest and manifest["size"] == st.st_size and manifest["mtime"] == st.st_mtime:
+        stats["skipped"] = True
+        stats["seconds"] = time.time() - start_time
+        return stats
+
+    file_hash, chunks, ids = scan(file_in, anchor_every)
+    stats["chunks"] = len(chunks)
+    if not (manifest and manifest["sha1"] == file_hash):
+        collection.create_index([("type", 1), ("id", 1)])
+        known = set(manifest["chunks"]) if manifest else set()
+        for start, end, checksum in chunks:
+            if checksum in known:
+                continue
+            stats["changed_chunks"] += 1
+            docs = []
+            for element in walker.get_element(parallel.RangeFile(file_in, start, end)):
+                el = data_processor.shape_element(element)
+                if el:
+                    docs.append(el)
+                    if len(docs) >= batch_size:
+                        stats["upserted"] += _upsert_changed(collection, docs)
+                        docs = []
+            if docs:
+                stats["upserted"] += _upsert_changed(collection, docs)
+        stats["deleted"] = _delete_missing(collection, ids, batch_size)
+    else:
+        stats["skipped"] = True
+
+    write_manifest(manifest_path, {
+        "version": MANIFEST_VERSION,
+        "collection": collection.full_name,
+        "anchor_every": anchor_every,
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "sha1": file_hash,
+        "chunks": [checksum for _, _, checksum in chunks],
+    })
+    stats["seconds"] = time.time() - start_time
+    return stats
+
+
+def test():
+    import mongomock
+    import shutil
+    import tempfile
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        osm_file = os.path.join(tmp_dir, 'example.osm')
+        shutil.copy('example.osm', osm_file)
+        collection = mongomock.MongoClient().osm.example
+
+        stats = sync(collection, osm_file, anchor_every=4)
+        pprint.pprint(stats)
+        assert stats["upserted"] == 22
+        assert collection.count_documents({}) == 22
+        assert sync(collection, osm_file, anchor_every=4)["skipped"]
+
+        # Bump one version and drop one node.
+        with open(osm_file) as f:
+            content = f.read()
+        content = content.replace('id="261114296" visible="true" version="6"',
+                                  'id="261114296" visible="true" version="7"')
+        content = re.sub(r' <node id="261114299"[^\n]*\n', '', content)
+        with open(osm_file, 'w') as f:
+            f.write(content)
+        stats = sync(collection, osm_file, anchor_every=4)
+        pprint.pprint(stats)
+        assert stats["upserted"] == 1
+        assert stats["deleted"] == 1
+        assert stats["changed_chunks"] < stats["chunks"]
+        assert collection.count_documents({}) == 21
+        assert collection.find_one({"id": "261114296"})["created"]["version"] == "7"
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    test()
@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import xml.etree.cElementTree as ET
 import pprint
 import re
+from collections import Counter
+
+import lru
+import sketch
+import walker
 """
 Your task is to explore the data a bit more.
 Before you process the data and add it into MongoDB, you should check the "k"
@@ -34,8 +38,51 @@ lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
 upper_colon = re.compile(r'^([A-Za-z]|_)*:([A-Za-z]|_)*$')
 multiple_colons = re.compile(r'^(([A-Za-z]|_)*:)+([A-Za-z]|_)*$')
 
+KEY_TYPES = ["lower", "upper", "lower_colon", "upper_colon", "multiple_colons", "numbers", "problemchars", "other"]
+
+
+# The checks of key_type in a single regular expression. The alternatives are
+# tried in the same order as the if/elif chain and the first one that matches
+# names the category: the first two are lookaheads that search the whole key,
+# the others must match all of it.
+key_classifier = re.compile(
+    r'(?P<problemchars>(?=.*[=\+/&<>;\'"\?%#$@\,\. \t\r\n]))'
+    r'|(?P<numbers>(?=.*[0-9]))'
+    r'|(?P<lower>[a-z_]*$)'
+    r'|(?P<upper>[A-Za-z_]*$)'
+    r'|(?P<lower_colon>[a-z_]*:[a-z_]*$)'
+    r'|(?P<upper_colon>[A-Za-z_]*:[A-Za-z_]*$)'
+    r'|(?P<multiple_colons>(?:[A-Za-z_]*:)+[A-Za-z_]*$)',
+    re.DOTALL)
+
+KEY_CACHE_SIZE = 100000
+
+_key_type_cache = lru.LRUCache(KEY_CACHE_SIZE)
+
+
+def classify_key(k):
+    """Return the key_type category of the tag key 'k'.
+
+    There are only a few thousand distinct keys in a real extract, so the
+    result is memoised per key string.
+    """
+    category = _key_type_cache.get(k)
+    if category is None:
+        m = key_classifier.match(k)
+        category = _key_type_cache.put(k, m.lastgroup if m else "other")
+    return category
+
 
 def key_type(k, counts, keys):
+    key_type = classify_key(k)
+    counts[key_type] += 1
+    keys[key_type].append(k)
+
+    return counts, keys
+
+
+# The original chain of searches, kept as the reference for classify_key.
+def reference_key_type(k):
     if problemchars.search(k):
         key_type = "problemchars"
     elif numbers.search(k):
@@ -52,40 +99,71 @@ def key_type(k, counts, keys):
         key_type = "multiple_colons"
     else:
         key_type = "other"
-
-    counts[key_type] += 1
-    keys[key_type].append(k)
-
-    return counts, keys
+    return key_type
 
 
 def process_map(filename):
-    counts = {"lower": 0, "upper": 0, "lower_colon": 0, "upper_colon": 0, "multiple_colons": 0, "numbers": 0, "problemchars": 0, "other": 0}
-    keys = {"lower": [], "upper": [], "lower_colon": [], "upper_colon": [], "multiple_colons": [], "numbers": [], "problemchars": [], "other": []}
-    for tag_key in all_tag_keys(filename):
+    counts = dict((key_type, 0) for key_type in KEY_TYPES)
+    keys = dict((key_type, []) for key_type in KEY_TYPES)
+    for tag_key in iter_tag_keys(filename):
         results, others = key_type(tag_key, counts, keys)
 
     return {'counts': results, 'keys': keys}
 
+def key_stats(filename, top_k=None):
+    """Streaming version of process_map.
+
+    Instead of a list with every occurrence of every key, 'keys' holds one
+    Counter of distinct keys per category, so memory grows with the key
+    vocabulary rather than with the number of tags. With 'top_k' set, each
+    category keeps a sketch.SpaceSaving of that many keys instead, which
+    bounds memory even when the vocabulary itself is huge.
+    """
+    counts = dict((key_type, 0) for key_type in KEY_TYPES)
+    if top_k:
+        keys = dict((key_type, sketch.SpaceSaving(top_k)) for key_type in KEY_TYPES)
+        for tag_key in iter_tag_keys(filename):
+            category = classify_key(tag_key)
+            counts[category] += 1
+            keys[category].add(tag_key)
+    else:
+        keys = dict((key_type, Counter()) for key_type in KEY_TYPES)
+        for tag_key in iter_tag_keys(filename):
+            category = classify_key(tag_key)
+            counts[category] += 1
+            keys[category][tag_key] += 1
+
+    return {'counts': counts, 'keys': keys}
+
+def iter_tag_keys(filename):
+    for element in walker.get_element(filename):
+        for tag in element.iter("tag"):
+            yield tag.get("k")
+
 def all_tag_keys(filename):
-    results = []
-    for _, element in ET.iterparse(filename):
-        if element.tag == "tag":
-            results.append(element.get("k"))
-    return results
+    return list(iter_tag_keys(filename))
 
 def unique_tag_keys(filename):
-    return set(all_tag_keys(filename))
+    return set(iter_tag_keys(filename))
 
 def test():
     # You can use another testfile 'map.osm' to look at your solution
     # Note that the assertion below will be incorrect then.
     # Note as well that the test function here is only used in the Test Run;
     # when you submit, your code will be checked against a different dataset.
+    for k in unique_tag_keys('example.osm') | set(["", "a:b:c", "A:b", "a1", "a b", "\n", "a\n", "-"]):
+        assert classify_key(k) == reference_key_type(k)
+
     results = process_map('example.osm')
     pprint.pprint(results['counts'])
     assert results['counts'] == {"lower": 5, "upper": 1, "lower_colon": 0, "upper_colon": 0, "multiple_colons": 0, "numbers": 0, "problemchars": 1, "other": 0}
 
+    stats = key_stats('example.osm')
+    assert stats['counts'] == results['counts']
+    for category, category_keys in results['keys'].iteritems():
+        assert stats['keys'][category] == Counter(category_keys)
+    assert key_stats('example.osm', top_k=4)['keys']['lower'].most_common(1) == [('highway', 2)]
+
 
 if __name__ == "__main__":
     test()
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import xml.etree.cElementTree as ET
+import mmap
 import pprint
 import re
+
+import walker
 """
 Your task is to explore the data a bit more.
 The first task is a fun one - find out how many unique users
@@ -17,7 +19,7 @@ def get_user(element):
 
 def process_map(filename):
     users = set()
-    for _, element in ET.iterparse(filename):
+    for element in walker.get_element(filename):
         u = element.get('user')
         if u:
             users.add(u)
@@ -25,11 +27,85 @@ def process_map(filename):
     return users
 
 
+# A 'user' or 'uid' attribute. Only top level elements carry these and, as
+# written by OSM tools, attributes are separated by a single space and
+# double-quoted. Starting the pattern with a literal lets the regex engine
+# skip ahead quickly, which is where most of the speed of the scan comes from.
+attribute_pattern = {
+    'user': re.compile(r' user="([^"]*)"'),
+    'uid': re.compile(r' uid="([^"]*)"'),
+}
+SCAN_BLOCK_SIZE = 16 * 1024 * 1024
+entity = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);')
+named_entities = {'amp': u'&', 'lt': u'<', 'gt': u'>', 'quot': u'"', 'apos': u"'"}
+
+def _replace_entity(m):
+    name = m.group(1)
+    if name.startswith('#x'):
+        return unichr(int(name[2:], 16))
+    if name.startswith('#'):
+        return unichr(int(name[1:]))
+    return named_entities[name]
+
+def unescape_attribute(raw):
+    """Decode a raw UTF-8 attribute value the way the XML parser does:
+    literal whitespace becomes a space and entities are replaced. Like
+    ElementTree, plain ASCII values are returned as str."""
+    value = raw.decode('utf-8')
+    value = value.replace(u'\r\n', u' ').replace(u'\r', u' ').replace(u'\n', u' ').replace(u'\t', u' ')
+    value = entity.sub(_replace_entity, value)
+    try:
+        return value.encode('ascii')
+    except UnicodeEncodeError:
+        return value
+
+def edit_counts(filename, key='user'):
+    """Count the top level elements per 'user' (or 'uid') with a byte scan
+    of the memory-mapped file, without building any Element objects.
+
+    Memory is proportional to the number of distinct contributors plus one
+    scan block.
+    """
+    pattern = attribute_pattern[key]
+    raw_counts = {}
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            # Scan in blocks cut just before a '<', which never appears inside
+            # an attribute value, so no match is split between two blocks.
+            start = 0
+            while start < len(mm):
+                end = start + SCAN_BLOCK_SIZE
+                if end < len(mm):
+                    cut = mm.rfind('<', start + 1, end)
+                    if cut != -1:
+                        end = cut
+                for raw in pattern.findall(mm, start, end):
+                    raw_counts[raw] = raw_counts.get(raw, 0) + 1
+                start = end
+        finally:
+            mm.close()
+
+    counts = {}
+    for raw, count in raw_counts.iteritems():
+        value = unescape_attribute(raw)
+        if value:
+            counts[value] = counts.get(value, 0) + count
+    return counts
+
+def process_map_fast(filename, key='user'):
+    """Same result as process_map (for key='user'), from a byte scan."""
+    return set(edit_counts(filename, key))
+
+
 def test():
 
     users = process_map('example.osm')
     pprint.pprint(users)
     assert len(users) == 6
+    assert process_map_fast('example.osm') == users
+    assert edit_counts('example.osm')['bbmiller'] == 13
+    assert unescape_attribute('J&amp;K &#252;\tx') == u'J&K \xfc x'
 
 
 
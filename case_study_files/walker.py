@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import xml.etree.cElementTree as ET
+"""
+Streaming helpers shared by the case study scripts.
+
+ET.iterparse on its own keeps every parsed element attached to the root of the
+document, so the whole tree ends up in memory by the end of the file. The
+walker below only hands out complete top level elements (on their "end"
+event, once all of their children have been parsed) and clears the root
+afterwards, so memory stays flat no matter how big the OSM file is.
+
+Reference:
+http://stackoverflow.com/questions/3095434/inserting-newlines-in-xml-file-generated-via-xml-etree-elementtree-in-python
+"""
+
+TOP_LEVEL_TAGS = ('node', 'way', 'relation')
+
+
+def get_element(osm_file, tags=TOP_LEVEL_TAGS):
+    """Yield each complete top level element whose tag is in 'tags'.
+
+    The element (and everything parsed before it) is cleared as soon as the
+    caller asks for the next one, so callers must not keep references to it.
+    """
+    context = iter(ET.iterparse(osm_file, events=('start', 'end')))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in TOP_LEVEL_TAGS:
+            if elem.tag in tags:
+                yield elem
+            root.clear()
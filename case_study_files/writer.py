@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import os
+import tempfile
+"""
+Buffered JSON Lines writer for shaped elements.
+
+Serialised documents are collected in memory and written out in large
+blocks instead of one write per element, optionally through gzip or zstd.
+The serialiser is pluggable:
+
+- "json": json.dumps with its default separators; the same bytes as
+  data.process_map has always written,
+- "compact": json.dumps without the spaces after ',' and ':',
+- "ujson" / "orjson": the faster third party encoders, when installed,
+- "auto": the fastest of the above that is available.
+
+Every backend writes one compact document per line, which is what
+mongoimport expects. pretty=True always uses json.dumps(indent=2).
+
+    with JSONLinesWriter("oxford_england.osm.json.gz") as writer:
+        for el in data.iter_map(OSMFILE):
+            writer.write(el)
+"""
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BUFFER_SIZE = 1 << 20
+
+
+def _dumps_json(doc):
+    return json.dumps(doc)
+
+
+def _dumps_compact(doc):
+    return json.dumps(doc, separators=(',', ':'))
+
+
+def _dumps_ujson(doc):
+    return ujson.dumps(doc, escape_forward_slashes=False)
+
+
+def _dumps_orjson(doc):
+    return orjson.dumps(doc)
+
+
+def _dumps_pretty(doc):
+    return json.dumps(doc, indent=2)
+
+
+def available_backends():
+    backends = ["json", "compact"]
+    if ujson is not None:
+        backends.append("ujson")
+    if orjson is not None:
+        backends.append("orjson")
+    return backends
+
+
+def serializer(backend="auto"):
+    """Return the function that turns a document into one line of JSON."""
+    if backend == "auto":
+        backend = available_backends()[-1]
+    if backend == "json":
+        return _dumps_json
+    if backend == "compact":
+        return _dumps_compact
+    if backend == "ujson":
+        if ujson is None:
+            raise ImportError("The ujson backend needs the ujson package")
+        return _dumps_ujson
+    if backend == "orjson":
+        if orjson is None:
+            raise ImportError("The orjson backend needs the orjson package")
+        return _dumps_orjson
+    raise ValueError("Unknown JSON backend: {0}".format(backend))
+
+
+def compression_for(path):
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+class JSONLinesWriter(object):
+    """Write documents to 'path' as JSON Lines.
+
+    'compression' is None, "gzip" or "zstd"; by default it follows the file
+    extension (.gz / .zst).
+    """
+
+    def __init__(self, path, backend="auto", compression="infer", pretty=False,
+                 buffer_size=BUFFER_SIZE):
+        if compression == "infer":
+            compression = compression_for(path)
+        self.dumps = _dumps_pretty if pretty else serializer(backend)
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.written = 0
+        self.raw = None
+        if compression is None:
+            self.fo = open(path, "wb")
+        elif compression == "gzip":
+            self.fo = gzip.open(path, "wb", 6)
+        elif compression == "zstd":
+            if zstandard is None:
+                raise ImportError("zstd compression needs the zstandard package")
+            self.raw = open(path, "wb")
+            self.fo = zstandard.ZstdCompressor(level=3).stream_writer(self.raw)
+        else:
+            raise ValueError("Unknown compression: {0}".format(compression))
+
+    def write(self, doc):
+        line = self.dumps(doc)
+        self.buffer.append(line)
+        self.buffered += len(line) + 1
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            block = b"\n".join(self.buffer) + b"\n"
+            self.fo.write(block)
+            self.written += len(block)
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        if self.fo is None:
+            return
+        self.flush()
+        if self.raw is not None:
+            self.fo.flush(zstandard.FLUSH_FRAME)
+            self.raw.close()
+        else:
+            self.fo.close()
+        self.fo = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_json_lines(path, documents, **kwargs):
+    """Write all of 'documents' to 'path' and return the number of bytes of
+    (uncompressed) JSON written."""
+    with JSONLinesWriter(path, **kwargs) as writer:
+        for doc in documents:
+            writer.write(doc)
+    return writer.written
+
+
+def read_json_lines(path):
+    """Read back a file written by JSONLinesWriter (not pretty-printed)."""
+    compression = compression_for(path)
+    if compression == "gzip":
+        f = gzip.open(path, "rb")
+    elif compression == "zstd":
+        f = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        f = iter(f.read().splitlines())
+    else:
+        f = open(path, "rb")
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def test():
+    docs = [{"id": "1", "type": "node", "name": u"Caf\xe9 / Bar", "pos": [51.75, -1.25]},
+            {"id": "2", "type": "way", "node_refs": ["1", "3"]}]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for backend in available_backends():
+            for name in ["out.json", "out.json.gz"] + (["out.json.zst"] if zstandard else []):
+                path = os.path.join(tmp_dir, name)
+                write_json_lines(path, docs, backend=backend, buffer_size=10)
+                assert list(read_json_lines(path)) == docs, (backend, name)
+
+        path = os.path.join(tmp_dir, "out.json")
+        write_json_lines(path, docs, backend="json")
+        with open(path, "rb") as f:
+            assert f.read() == "".join(json.dumps(doc) + "\n" for doc in docs)
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+if __name__ == "__main__":
+    test()
@@ -1,14 +1,40 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+Generate a smaller sample of an OSM file.
 
-import xml.etree.ElementTree as ET  # Use cElementTree or lxml if too slow
+By default every k-th top level element is kept, as before. The sampler can
+also keep a fixed number of elements chosen uniformly at random (reservoir
+sampling), sample nodes, ways and relations separately (stratification) and
+add the nodes referenced by the sampled ways so that every way in the sample
+is complete (referential closure).
+
+Only one pass over the input is made, except with --closure, which needs a
+second pass to pick up the referenced nodes. The referenced node ids are
+kept in pages of 2**20 ids: a page holds a small sorted array of ids until it
+gets dense enough for a bitmap to be smaller, so the memory used follows the
+number of ids rather than how widely they are spread over the id space.
+
+    $ python sampler.py                                   # every 10th element
+    $ python sampler.py -k 50 --stratify --closure
+    $ python sampler.py --size 100000 --seed 1 in.osm out.osm
+"""
+import argparse
+import random
+import xml.etree.cElementTree as ET
+from array import array
+from bisect import bisect_left
 
 OSM_FILE = "oxford_england.osm"  # Replace this with your osm file
 SAMPLE_FILE = "oxford_england_sample.osm"
 
 k = 10 # Parameter: take every k-th top level element
 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
+TAGS = ('node', 'way', 'relation')
+BUFFER_SIZE = 1 << 20
+
+
+def get_element(osm_file, tags=TAGS):
     """Yield element if it is the right type of tag
 
     Reference:
@@ -22,13 +48,179 @@ def get_element(osm_file, tags=('node', 'way', 'relation')):
             root.clear()
 
 
-with open(SAMPLE_FILE, 'wb') as output:
+class NodeIdBitmap(object):
+    """Set of node ids in pages of PAGE_BITS ids. A page starts as a sorted
+    array of the ids' offsets in the page (4 bytes each) and becomes a
+    bitmap (one bit per id) once that would take less memory."""
+    PAGE_BITS = 1 << 20
+    DENSE = PAGE_BITS // 32
+
+    def __init__(self):
+        self.pages = {}
+
+    def add(self, node_id):
+        page, bit = divmod(node_id, self.PAGE_BITS)
+        offsets = self.pages.get(page)
+        if offsets is None:
+            self.pages[page] = array('I', [bit])
+        elif isinstance(offsets, bytearray):
+            offsets[bit >> 3] |= 1 << (bit & 7)
+        else:
+            i = bisect_left(offsets, bit)
+            if i < len(offsets) and offsets[i] == bit:
+                return
+            offsets.insert(i, bit)
+            if len(offsets) >= self.DENSE:
+                bitmap = bytearray(self.PAGE_BITS // 8)
+                for offset in offsets:
+                    bitmap[offset >> 3] |= 1 << (offset & 7)
+                self.pages[page] = bitmap
+
+    def __contains__(self, node_id):
+        page, bit = divmod(node_id, self.PAGE_BITS)
+        offsets = self.pages.get(page)
+        if offsets is None:
+            return False
+        if isinstance(offsets, bytearray):
+            return bool(offsets[bit >> 3] & (1 << (bit & 7)))
+        i = bisect_left(offsets, bit)
+        return i < len(offsets) and offsets[i] == bit
+
+
+class Reservoir(object):
+    """Uniform random sample of 'size' items from a stream (Algorithm R)."""
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.seen = 0
+        self.items = []
+
+    def offer(self, make_item):
+        """Offer the next stream item; 'make_item' is only called when the
+        item is kept, so rejected elements are never serialised."""
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append(make_item())
+        else:
+            j = self.rng.randrange(self.seen)
+            if j < self.size:
+                self.items[j] = make_item()
+
+
+def node_refs(element):
+    return [int(nd.get('ref')) for nd in element.iter('nd')]
+
+
+def write_header(output):
     output.write('<?xml version="1.0" encoding="UTF-8"?>\n')
     output.write('<osm>\n  ')
 
-    # Write every kth top level element
-    for i, element in enumerate(get_element(OSM_FILE)):
-        if i % k == 0:
-            output.write(ET.tostring(element, encoding='utf-8'))
 
+def write_footer(output):
     output.write('</osm>')
+
+
+def sample(osm_file=OSM_FILE, sample_file=SAMPLE_FILE, k=k, size=None,
+           stratify=False, closure=False, seed=None):
+    """Write a sample of 'osm_file' to 'sample_file' and return the number
+    of elements written per tag.
+
+    With 'size' set, a uniform random sample of that many elements is kept
+    (per tag when 'stratify' is set); otherwise every k-th element is kept
+    (every k-th of each tag when 'stratify' is set). With 'closure' set, the
+    nodes referenced by the sampled ways are written too.
+    """
+    written = dict((tag, 0) for tag in TAGS)
+
+    def stratum(tag):
+        return tag if stratify else None
+
+    def keep_every_kth(counters, tag):
+        i = counters.get(stratum(tag), 0)
+        counters[stratum(tag)] = i + 1
+        return i % k == 0
+
+    with open(sample_file, 'wb', BUFFER_SIZE) as output:
+        write_header(output)
+
+        if size is None and not closure:
+            counters = {}
+            for element in get_element(osm_file):
+                if keep_every_kth(counters, element.tag):
+                    output.write(ET.tostring(element, encoding='utf-8'))
+                    written[element.tag] += 1
+            write_footer(output)
+            return written
+
+        # First pass: decide which elements (by position in the file) to keep.
+        rng = random.Random(seed)
+        reservoirs = {}
+        counters = {}
+        selected = set()
+        referenced = NodeIdBitmap()
+        for i, element in enumerate(get_element(osm_file)):
+            if size is None:
+                if keep_every_kth(counters, element.tag):
+                    selected.add(i)
+                    if element.tag == 'way':
+                        for ref in node_refs(element):
+                            referenced.add(ref)
+                continue
+            key = stratum(element.tag)
+            if key not in reservoirs:
+                reservoirs[key] = Reservoir(size, rng)
+            if closure:
+                # A reservoir item can still be replaced, so its refs are
+                # only added once the pass is over; there are at most 'size'
+                # of them per reservoir.
+                make_item = lambda: (i, node_refs(element) if element.tag == 'way' else None)
+            else:
+                make_item = lambda: (i, element.tag, ET.tostring(element, encoding='utf-8'))
+            reservoirs[key].offer(make_item)
+
+        if not closure:
+            items = sorted(item for reservoir in reservoirs.values() for item in reservoir.items)
+            for _, tag, xml in items:
+                output.write(xml)
+                written[tag] += 1
+            write_footer(output)
+            return written
+
+        for reservoir in reservoirs.values():
+            for i, refs in reservoir.items:
+                selected.add(i)
+                for ref in refs or ():
+                    referenced.add(ref)
+
+        # Second pass: write the kept elements plus the referenced nodes, in
+        # file order.
+        for i, element in enumerate(get_element(osm_file)):
+            if i in selected or (element.tag == 'node' and int(element.get('id')) in referenced):
+                output.write(ET.tostring(element, encoding='utf-8'))
+                written[element.tag] += 1
+        write_footer(output)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a sample of an OSM file.")
+    parser.add_argument('osm_file', nargs='?', default=OSM_FILE)
+    parser.add_argument('sample_file', nargs='?', default=SAMPLE_FILE)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-k', type=int, default=k, help="take every k-th top level element")
+    group.add_argument('--size', type=int, help="take a uniform random sample of this many elements")
+    parser.add_argument('--stratify', action='store_true',
+                        help="sample nodes, ways and relations separately")
+    parser.add_argument('--closure', action='store_true',
+                        help="also write the nodes referenced by the sampled ways")
+    parser.add_argument('--seed', type=int, help="random seed for --size")
+    args = parser.parse_args(argv)
+
+    written = sample(args.osm_file, args.sample_file, k=args.k, size=args.size,
+                     stratify=args.stratify, closure=args.closure, seed=args.seed)
+    print "Wrote {node} nodes, {way} ways and {relation} relations to {0}".format(args.sample_file, **written)
+
+
+if __name__ == '__main__':
+    main()